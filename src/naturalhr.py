@@ -2,28 +2,65 @@ import json
 import logging
 import os
 import re
-from datetime import datetime, timedelta
-from pathlib import Path
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
 
 import attr
 import click
-import holidays
 import requests
-import requests_cache
 from dateutil.relativedelta import relativedelta
 from dateutil.rrule import DAILY, FR, MO, TH, TU, WE, rrule
-from pycookiecheat import chrome_cookies
-from requests_html import HTMLSession
+from durations import Duration
+from synthetic import (
+    CACHE_HOME,
+    DAY,
+    ENGINE,
+    HOUR,
+    MAX_WORKERS,
+    MINUTE,
+    PROFILER,
+    WORKING_WEEK,
+    IntervalIndex,
+    LocalCache,
+    StandupRepository,
+    confirm,
+    fetch_concurrently,
+    log_transport_stats,
+    mount_transport,
+    prompt,
+    start_profiling,
+)
 from terminaltables import AsciiTable
 from workdays import networkdays
 
 log = logging.getLogger(__name__)
-requests_cache.install_cache()
 
-# FIXME: envvar
-STANDUP_PATH = Path.home().joinpath('Work/standups')
 NATURAL_HR = 'https://www.naturalhr.net'
 NATURAL_HR_COOKIE = 'PHPSESSID'
+# how long to trust a validated session cookie that doesn't say when it expires
+NATURAL_HR_SESSION_TTL = 8 * HOUR
+# session cookies and pages, readable by nobody else
+NATURAL_HR_CREDENTIALS = 'naturalhr.sqlite'
+# how long each page is cached, by the first pattern matching its path
+NATURAL_HR_PAGE_TTLS = [
+    (r'/hr/self-service/timesheets/timesheet-add', DAY),
+    (r'/hr/self-service/time-off-add', DAY),
+    (r'/hr/self-service/time-off$', HOUR),
+    (r'/hr/self-service/timesheets/(index|timesheet-view/)', 5 * MINUTE),
+    (r'/hr/workflow-(view|approve/)', MINUTE),
+]
+# the cached pages each kind of POST makes stale, besides the posted page itself
+NATURAL_HR_INVALIDATIONS = [
+    (
+        r'/hr/self-service/timesheets/timesheet-(add|confirm)',
+        r'/hr/self-service/timesheets/(index|timesheet-view/)',
+    ),
+    (r'/hr/self-service/time-off-add', r'/hr/self-service/time-off$'),
+    (r'/hr/workflow-approve/', r'/hr/workflow-view$'),
+]
 HEADERS = {
     'Connection': 'keep-alive',
     'Cache-Control': 'max-age=0',
@@ -48,6 +85,11 @@ class TimeSheet(object):
     hours = attr.ib()
     links = attr.ib(factory=list)
 
+    @property
+    def seconds(self):
+        """`hours` as seconds, from naturalhr's `40h 0m` format."""
+        return Duration(self.hours).to_seconds()
+
     def link(self, link_type):
         for link in self.links:
             if link_type in link:
@@ -65,6 +107,24 @@ class TimeSheetEntry(object):
     reference = attr.ib()
     comments = attr.ib()
 
+    @property
+    def interval(self):
+        """Epoch seconds this entry spans, from its `0900` style times."""
+        day = self.date
+        if isinstance(day, str):
+            day = datetime.strptime(day, '%d/%m/%Y')
+        return tuple(
+            datetime.combine(
+                day, datetime.strptime(clock.replace(':', ''), '%H%M').time()
+            ).timestamp()
+            for clock in (self.start_time, self.end_time)
+        )
+
+
+@lru_cache()
+def standup_repository():
+    return StandupRepository(cache=LocalCache())
+
 
 def echo(colour, message):
     click.secho(str(message), fg=colour, bold=True)
@@ -76,33 +136,203 @@ def to_ascii_table(data):
     ).table
 
 
-def get_session(cookie=None):
-    session_cookie = chrome_cookies(NATURAL_HR).get(NATURAL_HR_COOKIE)
-    if not session_cookie:
-        log.error("Could't find a valid session cookie, please log in to Natural HR")
-        raise click.Abort
+def chrome_cookies(url):
+    from pycookiecheat import chrome_cookies
 
-    session = HTMLSession(mock_browser=True)
-    session.cookies = requests.cookies.cookiejar_from_dict(
-        dict(COOKIES, **{NATURAL_HR_COOKIE: session_cookie})
-    )
+    return chrome_cookies(url)
 
-    home_page = f'{NATURAL_HR}/hr/'
-    home_response = session.get(
-        home_page, headers=dict(HEADERS, **{'Origin': home_page, 'Referer': home_page})
-    )
 
-    if 'redirect' in home_response.url:
-        log.error("Could't find a valid session cookie, please log in to Natural HR")
-        click.launch(NATURAL_HR)
-        raise click.Abort
+def public_holidays(**kwargs):
+    import holidays
+
+    return holidays.SouthAfrica(**kwargs)
+
+
+def is_auth_redirect(response):
+    return 'redirect' in response.url
+
+
+class SessionManager:
+    """
+    One NaturalHR session per process. The validated session cookie is kept in
+    the credential cache until it expires, and Chrome's cookies are only
+    decrypted again once NaturalHR redirects a request to its login page.
+    """
+
+    def __init__(self, cache=None):
+        self._cache = cache
+        self._session = None
+        # bumped on every authentication, so concurrent requests that hit the
+        # same expired session only re-read the cookies once
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = LocalCache(
+                CACHE_HOME.joinpath(NATURAL_HR_CREDENTIALS), mode=0o600
+            )
+        return self._cache
+
+    def session(self):
+        if self._session is None:
+            from requests_html import HTMLSession
+
+            self._session = mount_transport(HTMLSession(mock_browser=True))
+            cached = self.cache.get('NaturalHRSession', NATURAL_HR_COOKIE)
+            if cached and cached.fresh:
+                self.use(cached.value)
+            else:
+                self.authenticate()
+        return self._session
+
+    def use(self, session_cookie):
+        self._session.cookies = requests.cookies.cookiejar_from_dict(
+            dict(COOKIES, **{NATURAL_HR_COOKIE: session_cookie})
+        )
+
+    def authenticate(self):
+        """Takes Chrome's session cookie, checking it against the home page."""
+        with PROFILER.span('cookies', 'chrome cookie decryption'):
+            session_cookie = chrome_cookies(NATURAL_HR).get(NATURAL_HR_COOKIE)
+        if not session_cookie:
+            log.error(
+                "Could't find a valid session cookie, please log in to Natural HR"
+            )
+            raise click.Abort
+        self.use(session_cookie)
+        self._generation += 1
+
+        home_page = f'{NATURAL_HR}/hr/'
+        home_response = self._session.get(
+            home_page,
+            headers=dict(HEADERS, **{'Origin': home_page, 'Referer': home_page}),
+        )
+        if is_auth_redirect(home_response):
+            log.error(
+                "Could't find a valid session cookie, please log in to Natural HR"
+            )
+            click.launch(NATURAL_HR)
+            raise click.Abort
+
+        # the server may have rotated the cookie, keep whatever it set last
+        cookie = [
+            cookie
+            for cookie in self._session.cookies
+            if cookie.name == NATURAL_HR_COOKIE
+        ][-1]
+        self.cache.set(
+            'NaturalHRSession',
+            NATURAL_HR_COOKIE,
+            cookie.value,
+            cookie.expires - time.time() if cookie.expires else NATURAL_HR_SESSION_TTL,
+        )
+
+    def request(self, method, url, **kwargs):
+        """Sends a request, authenticating again if it lands on the login page."""
+        session, generation = self.session(), self._generation
+        response = session.request(method, url, **kwargs)
+        if is_auth_redirect(response):
+            with self._lock:
+                if generation == self._generation:
+                    log.info('NaturalHR session expired, re-reading Chrome cookies')
+                    self.authenticate()
+            response = session.request(method, url, **kwargs)
+        return response
+
+
+SESSIONS = SessionManager()
+
+
+@attr.s(auto_attribs=True)
+class CachedPage:
+    url: str
+    text: str
+
+    @property
+    def html(self):
+        from requests_html import HTML
+
+        return HTML(url=self.url, html=self.text)
+
+
+class PageCache:
+    """
+    NaturalHR pages cached per endpoint for their `NATURAL_HR_PAGE_TTLS`, and
+    dropped as soon as a POST changes what they show.
+    """
+
+    namespace = 'NaturalHRPage'
+
+    def __init__(
+        self, ttls=NATURAL_HR_PAGE_TTLS, invalidations=NATURAL_HR_INVALIDATIONS
+    ):
+        self.ttls = ttls
+        self.invalidations = invalidations
+        self.enabled = True
+
+    @property
+    def cache(self):
+        return SESSIONS.cache
+
+    @staticmethod
+    def path(url):
+        return url[len(NATURAL_HR) :] if url.startswith(NATURAL_HR) else url
+
+    def ttl(self, url):
+        path = self.path(url)
+        return next(
+            (ttl for pattern, ttl in self.ttls if re.match(pattern, path)), None
+        )
+
+    def get(self, url):
+        if not self.enabled or not self.ttl(url):
+            return None
+        cached = self.cache.get(self.namespace, self.path(url))
+        if cached and cached.fresh:
+            return CachedPage(url, cached.value)
+        return None
+
+    def set(self, url, response):
+        ttl = self.enabled and self.ttl(url)
+        if ttl and response.ok and not is_auth_redirect(response):
+            self.cache.set(self.namespace, self.path(url), response.text, ttl)
+
+    def invalidate(self, url):
+        """Drops the page at `url` and every page a POST to it affects."""
+        path = self.path(url)
+        stale = [
+            affected
+            for pattern, affected in self.invalidations
+            if re.match(pattern, path)
+        ]
+        self.cache.delete(
+            self.namespace,
+            [
+                key
+                for key in self.cache.keys(self.namespace)
+                if key == path or any(re.match(pattern, key) for pattern in stale)
+            ],
+        )
 
-    return session
+
+PAGES = PageCache()
+
+
+def get_session():
+    return SESSIONS.session()
 
 
 def natural_api(session, url):
+    cached = PAGES.get(url)
+    if cached:
+        return cached
+
     url_headers = {'Origin': url, 'Referer': url}
-    return session.get(url, headers=dict(HEADERS, **url_headers))
+    response = SESSIONS.request('GET', url, headers=dict(HEADERS, **url_headers))
+    PAGES.set(url, response)
+    return response
 
 
 def natural_api_post(session, url, params):
@@ -110,12 +340,14 @@ def natural_api_post(session, url, params):
     headers = dict(HEADERS, **url_headers)
 
     # https://stackoverflow.com/a/22974646
-    r = session.post(
+    r = SESSIONS.request(
+        'POST',
         url,
         headers=headers,
         files={key: (None, value) for key, value in params.items()},
     )
     r.raise_for_status()
+    PAGES.invalidate(url)
 
     return r
 
@@ -173,13 +405,43 @@ def get_timesheet_entries(session, timesheet):
 
 
 @click.option('--debug', help='Enables debug logging.', is_flag=True, default=False)
+@click.option(
+    '--profile', help='Print where the time went.', is_flag=True, default=False
+)
+@click.option(
+    '--profile-output',
+    help='Also write a Chrome trace of the run to this file.',
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click.option(
+    '--concurrency',
+    type=click.IntRange(min=1),
+    default=MAX_WORKERS,
+    show_default=True,
+    help='Concurrent requests per host.',
+)
+@click.option(
+    '-c', '--no-cache', help='Ignore cached pages.', is_flag=True, default=False
+)
 @click.group(context_settings=dict(help_option_names=[u'-h', u'--help']))
-def synthetic(debug: bool):
+@click.pass_context
+def synthetic(
+    ctx,
+    debug: bool,
+    profile: bool,
+    profile_output: str,
+    concurrency: int,
+    no_cache: bool,
+):
     """Synthetic timesheets and approvals for naturalhr"""
     logging.basicConfig(
         format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
         level=logging.DEBUG if debug else logging.INFO,
     )
+    start_profiling(ctx, profile, profile_output)
+    ENGINE.concurrency = concurrency
+    PAGES.enabled = not no_cache
+    ctx.call_on_close(log_transport_stats)
 
 
 @synthetic.command('list')
@@ -195,7 +457,10 @@ def list_timesheets():
     # TODO: num_weeks argument
 
     for timesheet in last_months_timesheets:
-        echo('blue', '{week} {status} {hours}'.format(**attr.asdict(timesheet)))
+        echo(
+            'blue' if timesheet.seconds >= WORKING_WEEK else 'yellow',
+            '{week} {status} {hours}'.format(**attr.asdict(timesheet)),
+        )
         timesheet_entries = get_timesheet_entries(session, timesheet)
         print(
             to_ascii_table(
@@ -211,7 +476,7 @@ def choose_reference(references):
     reference_text = None
     while reference_text is None:
         if last_choice:
-            reference_idx = click.prompt(choice_text, type=int, default=last_choice)
+            reference_idx = prompt(choice_text, type=int, default=last_choice)
         else:
             click.echo(
                 ' '.join(
@@ -222,7 +487,7 @@ def choose_reference(references):
                     ]
                 )
             )
-            reference_idx = click.prompt(choice_text, type=int)
+            reference_idx = prompt(choice_text, type=int)
 
         if reference_idx == -1:
             click.echo(
@@ -242,7 +507,7 @@ def choose_reference(references):
 
 
 def ensure_references(timesheet_entries, references):
-    reference_store = STANDUP_PATH.joinpath('synthetic.json')
+    reference_store = standup_repository().home.joinpath('synthetic.json')
     stored_references = (
         json.loads(reference_store.read_text()) if reference_store.exists() else {}
     )
@@ -275,37 +540,94 @@ def ensure_references(timesheet_entries, references):
 weekend = (SAT, SUN)
 
 
-def get_leave_days():
-    session = get_session()
-    time_off_dates = []
-    for to in natural_api(session, f'{NATURAL_HR}/hr/self-service/time-off').html.xpath(
-        '//tr'
-    )[2:]:
-        parts = to.text.split()
-        if any('Working' in part for part in parts):
-            continue
+@attr.s(auto_attribs=True)
+class TimeOff:
+    leave_type: str
+    start_date: datetime
+    end_date: datetime
+    number_of_days: str
+    approved: str
+    state: str
+
+    @classmethod
+    def from_row(cls, row):
+        parts = row.text.split()
+        # is_leave = any('Emergency' in part for part in parts)
+        is_wfh = any('Working' in part for part in parts)
         declined = any('Declined' in part for part in parts)
         if declined:
             date_status_parts = parts[-7:]
         else:
             date_status_parts = parts[-6:]
 
-        start_date = datetime.strptime(date_status_parts[0], '%d/%m/%Y')
-        end_date = datetime.strptime(date_status_parts[1], '%d/%m/%Y')
+        return cls(
+            leave_type='WFH' if is_wfh else 'Leave',
+            start_date=datetime.strptime(date_status_parts[0], '%d/%m/%Y'),
+            end_date=datetime.strptime(date_status_parts[1], '%d/%m/%Y'),
+            number_of_days=date_status_parts[2],
+            approved=date_status_parts[4] if not declined else 'Declined',
+            state=date_status_parts[5] if not declined else '',
+        )
+
+    @property
+    def days(self):
+        """Ordinal days this request spans, end exclusive."""
+        return self.start_date.toordinal(), self.end_date.toordinal() + 1
+
 
-        current_date = start_date
-        time_off_dates.append(current_date)
-        while current_date <= end_date:
-            if current_date.weekday() not in weekend:
-                time_off_dates.append(current_date)
-            current_date += timedelta(days=1)
+class LeaveCalendar:
+    """
+    Time off requests, with the leave among them merged into sorted day
+    intervals so that checking a day is a bisect rather than a scan.
+    """
 
-    return set(sorted(time_off_dates))
+    def __init__(self, time_off=()):
+        self.time_off = IntervalIndex((*request.days, request) for request in time_off)
+        self.starts, self.ends = [], []
+        for start, end in sorted(
+            request.days for request in time_off if request.leave_type == 'Leave'
+        ):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @classmethod
+    def from_html(cls, html):
+        return cls([TimeOff.from_row(row) for row in html.xpath('//tr')[2:]])
+
+    def __iter__(self):
+        return iter(self.time_off.items)
+
+    def __len__(self):
+        return len(self.time_off)
+
+    def __contains__(self, day):
+        """Whether `day` is a weekday of leave."""
+        if day.weekday() in weekend:
+            return False
+        day = day.toordinal()
+        position = bisect_right(self.starts, day) - 1
+        return position >= 0 and day < self.ends[position]
+
+    def overlapping(self, start_date, end_date):
+        """Requests that share a day with [`start_date`, `end_date`]."""
+        return self.time_off.overlapping(
+            start_date.toordinal(), end_date.toordinal() + 1
+        )
+
+
+@lru_cache()
+def leave_calendar():
+    return LeaveCalendar.from_html(
+        natural_api(get_session(), f'{NATURAL_HR}/hr/self-service/time-off').html
+    )
 
 
 def timesheet_from_standup(day):
     week_start = day + relativedelta(weekday=MO(-1))
-    za_holidays = holidays.SouthAfrica()
+    za_holidays = public_holidays()
 
     if day in za_holidays:
         public_holiday = TimeSheetEntry(
@@ -314,25 +636,22 @@ def timesheet_from_standup(day):
         log.info(public_holiday)
         return [public_holiday]
 
-    if day in get_leave_days():
+    if day in leave_calendar():
         annual_leave = TimeSheetEntry(
             week_start, day, '0900', '1700', '0', 'Holiday', 'Annual Leave'
         )
         log.info(annual_leave)
         return [annual_leave]
 
-    standup_path = STANDUP_PATH.joinpath('{:%Y-%m-%d}.md'.format(day))
-    if not standup_path.exists():
+    standups = standup_repository()
+    if not standups.exists(day):
         # FIXME: my exception
-        raise Exception('Missing standup:\n\t{}'.format(standup_path))
-
-    os.system(f'bat {standup_path}')
-
-    comments = standup_path.read_text().rstrip().split('\n')
+        raise Exception('Missing standup:\n\t{}'.format(standups.path(day)))
 
-    _date, _, hours = re.search(r'# ([0-9\-]*)\ ?(\[(\d*)\])?', comments[0]).groups()
+    os.system(f'bat {standups.path(day)}')
 
-    comments = '\n'.join(comments[1:])
+    standup = standups.get(day)
+    comments = standup.comments
 
     if any([x == comments for x in ['Annual Leave', 'Public Holiday']]):
         return [
@@ -344,7 +663,7 @@ def timesheet_from_standup(day):
             TimeSheetEntry(week_start, day, '0900', '1700', '0', 'Off ill', comments)
         ]
 
-    hours = int(hours) if hours else 8
+    hours = standup.hours
     start = 9
     break_minutes = 60
     end = int(start + hours + (break_minutes / 60))
@@ -387,11 +706,16 @@ def timesheet_from_standup(day):
     raise Exception('No entries for {}'.format(day))
 
 
-def store_timesheets(session, timesheet_entries):
+def store_timesheets(session, timesheet_entries, existing_entries=()):
+    """Adds `timesheet_entries`, skipping any that clash with existing ones."""
     add_timesheet_url = '{}/hr/self-service/timesheets/timesheet-add'.format(NATURAL_HR)
+    recorded = IntervalIndex((*entry.interval, entry) for entry in existing_entries)
 
     for timesheet_entry in timesheet_entries:
-        # TODO: check if there are existing entries
+        clashes = recorded.overlapping(*timesheet_entry.interval)
+        if clashes:
+            log.warning(f'Skipping {timesheet_entry}, it overlaps {clashes}')
+            continue
         response = natural_api_post(
             session,
             add_timesheet_url,
@@ -413,6 +737,7 @@ def store_timesheets(session, timesheet_entries):
             'Added timesheet entry for {:%a%d/%m/%Y}'.format(timesheet_entry.date),
         )
         echo('yellow', timesheet_entry)
+        recorded.add(*timesheet_entry.interval, timesheet_entry)
 
 
 @synthetic.command('store')
@@ -449,6 +774,20 @@ def store_missing_timesheets():
         f'missing_days: {missing_days}\n'
     )
 
+    if missing_days:
+        za_holidays = public_holidays()
+        standups = standup_repository()
+        missing_standups = [
+            str(standups.path(day))
+            for day in standups.missing(missing_days[0], missing_days[-1])
+            if day not in za_holidays and day not in leave_calendar()
+        ]
+        if missing_standups:
+            # FIXME: my exception
+            raise Exception(
+                'Missing standups:\n\t{}'.format('\n\t'.join(missing_standups))
+            )
+
     missing_timesheet_entries = []
     for missing_day in missing_days:
         missing_timesheet_entries.extend(
@@ -457,7 +796,7 @@ def store_missing_timesheets():
             )
         )
 
-    store_timesheets(session, missing_timesheet_entries)
+    store_timesheets(session, missing_timesheet_entries, timesheet_entries)
 
 
 def confirm_timesheet(session, timesheet):
@@ -490,7 +829,7 @@ def confirm_draft_timesheets():
         timesheet
         for timesheet in get_timesheets(session)
         if timesheet.status == 'Draft'
-        and (timesheet.hours == '40h 0m' or beginning_of_the_month)
+        and (timesheet.seconds == WORKING_WEEK or beginning_of_the_month)
     ]
 
     for timesheet in draft_timesheets:
@@ -502,35 +841,14 @@ def confirm_draft_timesheets():
 @synthetic.command()
 def show_time_off():
     """List time off requests"""
-    session = get_session()
-
-    time_off = []
-    for to in natural_api(session, f'{NATURAL_HR}/hr/self-service/time-off').html.xpath(
-        '//tr'
-    )[2:]:
-        parts = to.text.split()
-        # is_leave = any('Emergency' in part for part in parts)
-        is_wfh = any('Working' in part for part in parts)
-        declined = any('Declined' in part for part in parts)
-        if declined:
-            date_status_parts = parts[-7:]
-        else:
-            date_status_parts = parts[-6:]
-
-        time_off.append(
-            {
-                'leave_type': 'WFH' if is_wfh else 'Leave',
-                'start_date': datetime.strptime(
-                    date_status_parts[0], '%d/%m/%Y'
-                ).strftime('%Y-%m-%d'),
-                'end_date': datetime.strptime(
-                    date_status_parts[1], '%d/%m/%Y'
-                ).strftime('%Y-%m-%d'),
-                'number_of_days': date_status_parts[2],
-                'approved': date_status_parts[4] if not declined else 'Declined',
-                'state': date_status_parts[5] if not declined else '',
-            }
+    time_off = [
+        dict(
+            attr.asdict(request),
+            start_date=f'{request.start_date:%Y-%m-%d}',
+            end_date=f'{request.end_date:%Y-%m-%d}',
         )
+        for request in leave_calendar()
+    ]
 
     print(to_ascii_table(sorted(time_off, key=lambda t: t['start_date'])[::-1]))
 
@@ -554,6 +872,16 @@ def request(leave_type, start_date, end_date):
         log.error('No employee id field found')
         raise click.Abort
 
+    overlapping = leave_calendar().overlapping(start_date, end_date)
+    for existing in overlapping:
+        echo(
+            'yellow',
+            f'{existing.leave_type} {existing.start_date:%Y-%m-%d} to '
+            f'{existing.end_date:%Y-%m-%d} is already {existing.approved}',
+        )
+    if overlapping and not confirm('Request anyway?'):
+        raise click.Abort
+
     leave_request = {
         'time_off_type': 'Home Emergency'
         if leave_type == 'Leave'
@@ -568,7 +896,7 @@ def request(leave_type, start_date, end_date):
             networkdays(
                 start_date.date(),
                 end_date.date(),
-                holidays=holidays.SouthAfrica(years=start_date.year),
+                holidays=public_holidays(years=start_date.year),
             )
         ),
         'submit': '',
@@ -577,6 +905,7 @@ def request(leave_type, start_date, end_date):
     natural_api_post(
         session, f'{NATURAL_HR}/hr/self-service/time-off-add', leave_request
     )
+    leave_calendar.cache_clear()
 
 
 @synthetic.command()
@@ -587,14 +916,18 @@ def approve():
     workflow_view = natural_api(session, f'{NATURAL_HR}/hr/workflow-view').html.xpath(
         '//div[@class="content"]//div[@class="media-body"]'
     )
+    approval_links = [workflow_item.links.pop() for workflow_item in workflow_view]
+    approval_pages = fetch_concurrently(
+        lambda link: natural_api(session, f'{NATURAL_HR}{link}').html,
+        approval_links,
+        NATURAL_HR,
+    )
     to_be_approved = []
     wfh_requests = []
-    for workflow_item in workflow_view:
-        approval_link = workflow_item.links.pop()
+    for workflow_item, approval_link in zip(workflow_view, approval_links):
         log.debug(approval_link)
-        hidden_fields = natural_api(session, f'{NATURAL_HR}{approval_link}').html.xpath(
-            '//input[@type="hidden"]'
-        )
+        approval_page = approval_pages[approval_link]
+        hidden_fields = approval_page.xpath('//input[@type="hidden"]')
 
         log.debug(workflow_item.text)
         item_parts = workflow_item.text.split()
@@ -623,9 +956,7 @@ def approve():
             name, surname = item_parts[:2]
             wfh_date = item_parts[6]
 
-            all_fields = natural_api(
-                session, f'{NATURAL_HR}{approval_link}'
-            ).html.xpath('//input')
+            all_fields = approval_page.xpath('//input')
             wfh_request = {
                 field.attrs['name']: field.attrs['value']
                 for field in all_fields
@@ -654,7 +985,7 @@ def approve():
         )
     )
     for wfh in wfh_requests:
-        if click.confirm(f'✅ WFH for {wfh["name"]} {wfh["wfh_date"]}️'):
+        if confirm(f'✅ WFH for {wfh["name"]} {wfh["wfh_date"]}️'):
             print(f'{NATURAL_HR}{wfh["link"]}')
             print(wfh['payload'])
             natural_api_post(session, f'{NATURAL_HR}{wfh["link"]}', wfh['payload'])
@@ -673,7 +1004,7 @@ def approve():
             )
         )
         for timesheet in to_be_approved:
-            if click.confirm(f'✅ {timesheet["name"]} {timesheet["week"]}️'):
+            if confirm(f'✅ {timesheet["name"]} {timesheet["week"]}️'):
                 natural_api_post(
                     session, f'{NATURAL_HR}{timesheet["link"]}', timesheet['payload']
                 )
@@ -1,74 +1,722 @@
+import hashlib
 import json
 import logging
 import os
+import random
 import re
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
-from functools import singledispatch
+from functools import lru_cache, partial, singledispatch
+from itertools import accumulate, chain
 from pathlib import Path
 from pprint import pprint
-from typing import List
+from typing import List, Tuple
+from urllib.parse import urlsplit
 
 import attr
 import click
-import coloredlogs
-import dateparser
-import inflect
-import mistune
+import requests
+from dateutil.parser import isoparse
 from dateutil.relativedelta import relativedelta
 from dateutil.tz import tzlocal
 from durations import Duration
-from plumbum.cmd import git
-from requests_cache import CachedSession
+from requests.adapters import HTTPAdapter
 from requests_toolbelt.sessions import BaseUrlSession
-from slacker import Slacker
 from terminaltables import AsciiTable
+from urllib3.util.retry import Retry
 
 log = logging.getLogger(__name__)
-# 4h, 15m
-DURATION_REGEX = re.compile(r'(?P<duration>[0-9]+[hm]+)')
 # QCO-9795
 JIRA_REF_REGEX = re.compile(r'(?P<jira_ref>[A-Z]+-[0-9]+)')
-# transaction-rules-engine#4
-PULL_REQUEST_REGEX = re.compile(r'(?P<repo_name>[a-z-]+)#(?P<pr_id>[0-9]+)')
+# QCO-9795, transaction-rules-engine#4, 4h, 15m, 1h30m
+NOTE_TOKEN_REGEX = re.compile(
+    r'(?P<jira_ref>\b[A-Z]+-[0-9]+\b)'
+    r'|(?P<pull_request>\b[a-z-]+#[0-9]+\b)'
+    r'|(?P<duration>(?<![\w-])[0-9]+'
+    r'(?:h(?:ours?|rs?)?(?:[0-9]+(?:m(?:ins?|inutes?)?)?)?|m(?:ins?|inutes?)?)'
+    r'(?![\w-]))'
+)
+# 1h30m, 1h30, 4hrs, 45min
+DURATION_PARTS_REGEX = re.compile(
+    r'(?:(?P<hours>[0-9]+)h[a-z]*)?(?:(?P<minutes>[0-9]+)[a-z]*)?'
+)
+# 2020-01-02 [6]
+STANDUP_HOURS_REGEX = re.compile(r'\[(?P<hours>\d+)\]')
+# 2020-01-02.md
+STANDUP_FILENAME_REGEX = re.compile(r'^\d{4}-\d{2}-\d{2}\.md$')
 WORKING_HOURS = dict(start='10am', end='6pm')
+# bounded pool for concurrent remote lookups
+MAX_WORKERS = 8
+# only the ticket fields we render
+JIRA_FIELDS = ['summary', 'status', 'description']
+# issue keys per JQL `key in (...)` search
+JIRA_SEARCH_CHUNK = 50
+STANDUP_HOME = Path(
+    os.environ.get('STANDUP_HOME', Path.home().joinpath('Work/standups'))
+)
+CACHE_HOME = Path(os.environ.get('SYNTHETIC_CACHE', click.get_app_dir('synthetic')))
+MINUTE, HOUR, DAY = 60, 60 * 60, 24 * 60 * 60
+WORKING_DAY, WORKING_WEEK = 8 * HOUR, 40 * HOUR
+# settled tickets and pull requests rarely change, in-flight ones often do
+DONE_TICKET_STATUSES = ['Done', 'Closed', 'Resolved', "Won't Do"]
+DONE_PULL_REQUEST_STATES = ['MERGED', 'DECLINED', 'SUPERSEDED']
+CACHE_TTLS = dict(done=30 * DAY, in_progress=15 * MINUTE)
+PROJECT_INDEX_TTL = DAY
+# toggl caps time_entries responses at this many entries
+TOGGL_PAGE_SIZE = 1000
+# https://github.com/toggl/toggl_api_docs#the-api-format
+TOGGL_REQUESTS_PER_SECOND = 1
+TOGGL_RETRIES = 5
+# how far back the first `sync` mirrors time entries
+TOGGL_MIRROR_MONTHS = 12
+# toggl's `me?since=` only reports changes made this recently
+TOGGL_CHANGES_WINDOW = 9 * DAY
+SLACK_PAGE_SIZE = 200
+SLACK_USER_TTL = 7 * DAY
+# repositories outside the default bitbucket org, as `repo=org,repo=org`
+BITBUCKET_REPOSITORY_ORGS = os.environ.get(
+    'BITBUCKET_ORGS', 'quidco-web-app=john_pervanas,quidco-packages=john_pervanas'
+)
+BITBUCKET_DEFAULT_ORG = os.environ.get('BITBUCKET_ORG', 'maplesyrupgroup')
+# connection pools are per host, sized for the concurrent lookups
+HTTP_POOL_HOSTS = 10
+HTTP_POOL_SIZE = MAX_WORKERS
+# (connect, read) seconds
+HTTP_TIMEOUT = (3.05, 30)
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+# parsed standups are keyed on their content, so they can live long
+STANDUP_CACHE_TTL = 365 * DAY
 
 
 def local_iso(dt: datetime):
     return dt.astimezone(tzlocal()).isoformat()
 
 
-class TogglSession(BaseUrlSession, CachedSession):
-    def __init__(self, token):
+def as_date(day):
+    return day.date() if isinstance(day, datetime) else day
+
+
+# python 3.6 has no datetime.fromisoformat
+fromisoformat = getattr(datetime, 'fromisoformat', isoparse)
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(value: str) -> datetime:
+    """
+    Parses toggl's ISO-8601 timestamps directly, leaving dateparser for
+    free-form input like `2020-01-02 10am`.
+    """
+    try:
+        return fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        import dateparser
+
+        parsed = dateparser.parse(value)
+        if parsed is None:
+            raise ValueError(f'Unrecognised timestamp: {value!r}')
+        return parsed
+
+
+@lru_cache()
+def working_hours(day, boundary='start') -> datetime:
+    """The local `WORKING_HOURS` `boundary` on `day`."""
+    try:
+        at = datetime.strptime(WORKING_HOURS[boundary], '%I%p').time()
+    except ValueError:
+        at = parse_timestamp(WORKING_HOURS[boundary]).time()
+    return datetime.combine(as_date(day), at).astimezone(tzlocal())
+
+
+@attr.s(auto_attribs=True)
+class Span:
+    kind: str
+    name: str
+    start: float
+    duration: float
+    thread: int
+    details: dict
+
+
+class Profiler:
+    """Collects timed spans while enabled, for a summary table or a trace file."""
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, kind, name, **details):
+        """Times the block, which can add to the yielded `details`."""
+        if not self.enabled:
+            yield details
+            return
+
+        start = time.perf_counter()
+        try:
+            yield details
+        finally:
+            span = Span(
+                kind,
+                name,
+                start - self.origin,
+                time.perf_counter() - start,
+                threading.get_ident(),
+                details,
+            )
+            with self._lock:
+                self.spans.append(span)
+
+    def summary(self):
+        totals = defaultdict(list)
+        for span in self.spans:
+            totals[(span.kind, span.name)].append(span.duration)
+        return [
+            [
+                kind,
+                name,
+                len(durations),
+                f'{sum(durations) * 1000:.1f}',
+                f'{max(durations) * 1000:.1f}',
+            ]
+            for (kind, name), durations in sorted(
+                totals.items(), key=lambda item: sum(item[1]), reverse=True
+            )
+        ]
+
+    def chrome_trace(self):
+        """Spans as trace events, for chrome://tracing or ui.perfetto.dev"""
+        return dict(
+            traceEvents=[
+                dict(
+                    name=span.name,
+                    cat=span.kind,
+                    ph='X',
+                    ts=int(span.start * 1e6),
+                    dur=int(span.duration * 1e6),
+                    pid=os.getpid(),
+                    tid=span.thread,
+                    args=span.details,
+                )
+                for span in self.spans
+            ]
+        )
+
+    def report(self, output=None):
+        print(
+            AsciiTable(
+                [['kind', 'name', 'count', 'total ms', 'max ms']] + self.summary()
+            ).table
+        )
+        if output:
+            Path(output).write_text(
+                json.dumps(self.chrome_trace(), default=to_serializable)
+            )
+            log.info(f'Wrote trace to {output}')
+
+
+PROFILER = Profiler()
+
+
+def start_profiling(ctx, profile, profile_output):
+    if profile or profile_output:
+        PROFILER.enabled = True
+        ctx.call_on_close(lambda: PROFILER.report(profile_output))
+
+
+def confirm(text, **kwargs):
+    with PROFILER.span('prompt', 'confirm'):
+        return click.confirm(text, **kwargs)
+
+
+def prompt(text, **kwargs):
+    with PROFILER.span('prompt', 'prompt'):
+        return click.prompt(text, **kwargs)
+
+
+@attr.s(auto_attribs=True)
+class CacheEntry:
+    value: dict
+    expires: float
+    etag: str = None
+    last_modified: str = None
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires
+
+    @property
+    def validators(self):
+        """Conditional request headers for revalidating a stale entry."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class LocalCache:
+    """
+    Namespaced, on-disk record cache with per-entry expiry. A `mode` keeps the
+    file private, e.g. 0o600 for credentials.
+    """
+
+    def __init__(self, path=None, mode=None):
+        self.path = Path(path or CACHE_HOME.joinpath('cache.sqlite'))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if mode is not None:
+            os.close(os.open(str(self.path), os.O_CREAT | os.O_WRONLY, mode))
+            os.chmod(str(self.path), mode)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'namespace TEXT, key TEXT, value TEXT, expires REAL, '
+                'etag TEXT, last_modified TEXT, PRIMARY KEY (namespace, key))'
+            )
+
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value, expires, etag, last_modified FROM entries '
+                'WHERE namespace = ? AND key = ?',
+                (namespace, str(key)),
+            ).fetchone()
+        if not row:
+            return None
+        value, expires, etag, last_modified = row
+        return CacheEntry(json.loads(value), expires, etag, last_modified)
+
+    def set(self, namespace, key, value, ttl, etag=None, last_modified=None):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    namespace,
+                    str(key),
+                    json.dumps(value, default=to_serializable),
+                    time.time() + ttl,
+                    etag,
+                    last_modified,
+                ),
+            )
+
+    def set_many(self, namespace, values: dict, ttl):
+        expires = time.time() + ttl
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, NULL, NULL)',
+                [
+                    (namespace, str(key), json.dumps(value), expires)
+                    for key, value in values.items()
+                ],
+            )
+
+    def touch(self, namespace, key, ttl):
+        """Extends an entry that the server confirmed is unchanged."""
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE entries SET expires = ? WHERE namespace = ? AND key = ?',
+                (time.time() + ttl, namespace, str(key)),
+            )
+
+    def keys(self, namespace):
+        with self._lock:
+            return [
+                key
+                for key, in self._db.execute(
+                    'SELECT key FROM entries WHERE namespace = ?', (namespace,)
+                )
+            ]
+
+    def delete(self, namespace, keys):
+        with self._lock, self._db:
+            self._db.executemany(
+                'DELETE FROM entries WHERE namespace = ? AND key = ?',
+                [(namespace, str(key)) for key in keys],
+            )
+
+    def stats(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT namespace, COUNT(*), SUM(expires > ?), SUM(LENGTH(value)) '
+                'FROM entries GROUP BY namespace ORDER BY namespace',
+                (time.time(),),
+            ).fetchall()
+
+    def prune(self, namespace=None):
+        """Removes expired entries, returning how many were dropped."""
+        query, params = 'DELETE FROM entries WHERE expires <= ?', [time.time()]
+        if namespace:
+            query, params = f'{query} AND namespace = ?', params + [namespace]
+        with self._lock, self._db:
+            return self._db.execute(query, params).rowcount
+
+
+class CachedRecordsMixin:
+    """
+    Caches parsed records in a `LocalCache`, keeping them for their
+    `cache_ttl` and revalidating stale ones with conditional requests.
+    """
+
+    cache = None
+
+    def cached_record(self, record_type, key, path, from_json, **kwargs):
+        with PROFILER.span('cache', record_type.__name__, key=key) as details:
+            entry = self.cache.get(record_type.__name__, key) if self.cache else None
+            details['hit'] = bool(entry and entry.fresh)
+        if entry and entry.fresh:
+            return record_type(**entry.value)
+
+        headers = dict(kwargs.pop('headers', {}), **(entry.validators if entry else {}))
+        response = self.get(path, headers=headers, **kwargs)
+        if entry and response.status_code == 304:
+            record = record_type(**entry.value)
+            self.cache.touch(record_type.__name__, key, record.cache_ttl)
+            return record
+
+        response.raise_for_status()
+        record = from_json(response.json())
+        self.cache_record(key, record, response)
+        return record
+
+    def cache_record(self, key, record, response=None):
+        if not self.cache:
+            return
+        headers = response.headers if response is not None else {}
+        self.cache.set(
+            type(record).__name__,
+            key,
+            attr.asdict(record),
+            record.cache_ttl,
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified'),
+        )
+
+
+class JitteredRetry(Retry):
+    """Exponential backoff with full jitter, so concurrent retries spread out."""
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+
+class Transport(HTTPAdapter):
+    """
+    Connection pools shared by every client, with keep-alive, default timeouts,
+    retries with jittered backoff for idempotent requests, and per-host stats.
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT):
+        self.timeout = timeout
+        super().__init__(
+            pool_connections=HTTP_POOL_HOSTS,
+            pool_maxsize=HTTP_POOL_SIZE,
+            max_retries=JitteredRetry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF_FACTOR,
+                status_forcelist=[429, 502, 503, 504],
+                raise_on_status=False,
+            ),
+        )
+
+    def resize(self, maxsize):
+        """Grows each host's pool to keep `maxsize` concurrent connections."""
+        if maxsize > self._pool_maxsize:
+            self.init_poolmanager(
+                self._pool_connections, maxsize, block=self._pool_block
+            )
+
+    def send(self, request, timeout=None, **kwargs):
+        url = urlsplit(request.url)
+        with PROFILER.span(
+            'http', f'{request.method} {url.netloc}', path=url.path
+        ) as details:
+            response = super().send(request, timeout=timeout or self.timeout, **kwargs)
+            details.update(
+                status=response.status_code,
+                bytes=int(response.headers.get('Content-Length', 0)),
+            )
+            return response
+
+    def stats(self):
+        """(host, requests, connections opened) for each pooled host."""
+        pools = self.poolmanager.pools
+        return [
+            (key.key_host, pools[key].num_requests, pools[key].num_connections)
+            for key in pools.keys()
+        ]
+
+
+@lru_cache()
+def shared_transport():
+    return Transport()
+
+
+def log_transport_stats():
+    for host, requests_sent, connections in shared_transport().stats():
+        log.debug(f'{host}: {requests_sent} requests over {connections} connections')
+
+
+def mount_transport(session):
+    """Routes `session` through the shared transport."""
+    for prefix in ['https://', 'http://']:
+        session.mount(prefix, shared_transport())
+    session.headers.update(
+        {'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'}
+    )
+    return session
+
+
+class ProjectIndex:
+    """Toggl projects across workspaces, by name and by id."""
+
+    def __init__(self, projects):
+        self.projects = list(projects)
+        self.by_id = {project.id: project for project in self.projects}
+        self.by_name = defaultdict(dict)
+        for project in self.projects:
+            self.by_name[project.name].setdefault(project.wid, project)
+
+    def get(self, project_name, workspace_id=None):
+        by_workspace = self.by_name.get(project_name, {})
+        if workspace_id:
+            return by_workspace.get(workspace_id)
+        return next(iter(by_workspace.values()), None)
+
+
+class TogglSession(BaseUrlSession):
+    def __init__(self, token, cache=None):
         super().__init__(base_url='https://www.toggl.com/api/v8/')
+        mount_transport(self)
         self.auth = (token, 'api_token')
+        self.cache = cache
+        self._project_index = None
+        self._project_index_refreshed = False
+
+    def workspaces(self):
+        return [workspace['id'] for workspace in self.get('workspaces').json()]
 
-    def projects(self):
-        workspace_id = self.get('workspaces').json()[0]['id']
+    def projects(self, workspace_id=None):
         return [
-            Project(id=project['id'], name=project['name'])
-            for project in self.get(f'workspaces/{workspace_id}/projects').json()
+            Project(id=project['id'], name=project['name'], wid=wid)
+            for wid in ([workspace_id] if workspace_id else self.workspaces())
+            for project in self.get(f'workspaces/{wid}/projects').json()
         ]
 
-    def get_project(self, project_name):
-        projects = [
-            project for project in self.projects() if project.name == project_name
-        ]
-        if projects:
-            return projects[0]
-        return None
+    def project_index(self, refresh=False):
+        """
+        Builds the project index once, reusing the cached copy until its TTL
+        runs out or a `refresh` is requested.
+        """
+        if self._project_index and not refresh:
+            return self._project_index
+
+        cached = self.cache and self.cache.get(ProjectIndex.__name__, 'projects')
+        if cached and cached.fresh and not refresh:
+            projects = [Project(**project) for project in cached.value]
+        else:
+            projects = self.projects()
+            if self.cache:
+                self.cache.set(
+                    ProjectIndex.__name__,
+                    'projects',
+                    [attr.asdict(project) for project in projects],
+                    PROJECT_INDEX_TTL,
+                )
+            self._project_index_refreshed = True
+
+        self._project_index = ProjectIndex(projects)
+        return self._project_index
+
+    def get_project(self, project_name, workspace_id=None):
+        project = self.project_index().get(project_name, workspace_id)
+        if not project and not self._project_index_refreshed:
+            log.debug(f'{project_name} not in project index, refreshing')
+            project = self.project_index(refresh=True).get(project_name, workspace_id)
+        return project
+
+    def time_entry_pages(self, start_date: datetime, end_date: datetime):
+        """
+        Raw time entry pages between two dates in one range query, paging
+        forward past the last entry whenever toggl returns a full page.
+        """
+        while True:
+            page = self.get(
+                'time_entries',
+                params=dict(
+                    start_date=local_iso(start_date), end_date=local_iso(end_date)
+                ),
+            ).json()
+            yield page
+
+            if len(page) < TOGGL_PAGE_SIZE:
+                return
+            last_start = max(parse_timestamp(entry['start']) for entry in page)
+            if last_start <= start_date.astimezone(tzlocal()):
+                return
+            start_date = last_start
+
+    def changes(self, since: int):
+        """
+        Projects and time entries changed since the `since` cursor, along with
+        the next cursor. Toggl only reports entries from the last 9 days here.
+        """
+        return self.get('me', params=dict(with_related_data='true', since=since)).json()
+
+    def time_entries(self, start_date: datetime, end_date: datetime):
+        entries = {}
+        for page in self.time_entry_pages(start_date, end_date):
+            entries.update(
+                (entry['id'], ListTimeEntry.from_json(entry)) for entry in page
+            )
+        return list(entries.values())
+
+    def time_entry_columns(self, start_date: datetime, end_date: datetime):
+        return TimeEntryColumns.from_json(
+            entry
+            for page in self.time_entry_pages(start_date, end_date)
+            for entry in page
+        )
+
+    def get_project_by_id(self, project_id):
+        project = self.project_index().by_id.get(project_id)
+        if not project and not self._project_index_refreshed:
+            project = self.project_index(refresh=True).by_id.get(project_id)
+        return project
 
 
-class JiraSession(BaseUrlSession, CachedSession):
-    def __init__(self, user, token):
+def error_messages(response):
+    """The `errorMessages` of a Jira error response, if it has any."""
+    try:
+        return response.json().get('errorMessages') or []
+    except ValueError:
+        return []
+
+
+class JiraSession(CachedRecordsMixin, BaseUrlSession):
+    def __init__(self, user, token, cache=None):
         super().__init__(base_url='https://quidco.atlassian.net/rest/api/latest/')
+        mount_transport(self)
         self.auth = (user, token)
+        self.cache = cache
 
+    def search(self, jql, fields=JIRA_FIELDS):
+        """
+        Pages through the issues matching `jql`, projecting only `fields`.
+        Unknown issue keys are warnings rather than errors.
+        """
+        start_at = 0
+        while True:
+            response = self.get(
+                'search',
+                params=dict(
+                    jql=jql,
+                    fields=','.join(fields),
+                    startAt=start_at,
+                    validateQuery='warn',
+                ),
+            )
+            response.raise_for_status()
+            page = response.json()
+            yield from page['issues']
+
+            start_at += len(page['issues'])
+            if not page['issues'] or start_at >= page['total']:
+                break
 
-class BitbucketSession(BaseUrlSession, CachedSession):
-    def __init__(self, user, token):
+    def search_keys(self, keys):
+        """The issues for `keys`, without the keys Jira rejects by name."""
+        while keys:
+            try:
+                return list(self.search(f'key in ({",".join(keys)})'))
+            except requests.HTTPError as e:
+                rejected = set(
+                    JIRA_REF_REGEX.findall(' '.join(error_messages(e.response)))
+                ) & set(keys)
+                log.debug(f'JQL search rejected {rejected or keys}: {e}')
+                if not rejected:
+                    return []
+                keys = [key for key in keys if key not in rejected]
+        return []
+
+    def tickets_for(self, refs):
+        """
+        Resolves `refs` with one JQL search per chunk of keys, returning tickets
+        by ref. Fresh cached tickets are used as is, stale ones are revalidated
+        individually, and refs the search rejects or doesn't return (unknown or
+        moved issues) fall back to per-issue fetches. Keys named in a rejection
+        are dropped and the rest of their chunk searched again.
+        """
+        refs = list(dict.fromkeys(refs))
+        tickets, stale = {}, []
+        for ref in refs:
+            entry = self.cache.get(Ticket.__name__, ref) if self.cache else None
+            if entry and entry.fresh:
+                tickets[ref] = Ticket(**entry.value)
+            elif entry and entry.validators:
+                stale.append(ref)
+
+        unresolved = [ref for ref in refs if ref not in tickets and ref not in stale]
+        chunks = [
+            unresolved[start : start + JIRA_SEARCH_CHUNK]
+            for start in range(0, len(unresolved), JIRA_SEARCH_CHUNK)
+        ]
+        for chunk in chunks:
+            for issue in self.search_keys(chunk):
+                if issue['key'] in chunk:
+                    tickets[issue['key']] = Ticket.from_issue(issue)
+                    self.cache_record(issue['key'], tickets[issue['key']])
+
+        missing = [ref for ref in refs if ref not in tickets]
+        if missing:
+            log.debug(f'Fetching {missing} individually')
+            tickets.update(resolve_tickets(self, missing))
+        return {ref: tickets[ref] for ref in refs}
+
+
+class BitbucketSession(CachedRecordsMixin, BaseUrlSession):
+    def __init__(
+        self,
+        user,
+        token,
+        cache=None,
+        repository_orgs=BITBUCKET_REPOSITORY_ORGS,
+        default_org=BITBUCKET_DEFAULT_ORG,
+    ):
         super().__init__(base_url='https://api.bitbucket.org/2.0/')
+        mount_transport(self)
         self.auth = (user, token)
+        self.cache = cache
+        self.repository_orgs = {}
+        for repository_org in filter(None, repository_orgs.split(',')):
+            repo_name, _, org = repository_org.partition('=')
+            if not (repo_name and org):
+                raise click.UsageError(
+                    f'BITBUCKET_ORGS entries should be repo=org, not {repository_org!r}'
+                )
+            self.repository_orgs[repo_name] = org
+        self.default_org = default_org
+
+    def org_for(self, repo_name):
+        return self.repository_orgs.get(repo_name, self.default_org)
+
+    def pull_requests_for(self, refs):
+        """Resolves unique (repo_name, pr_id) refs concurrently, by ref."""
+        return fetch_concurrently(
+            lambda ref: PullRequest.from_ref(self, *ref), refs, host_of(self)
+        )
 
 
 # https://hynek.me/articles/serialization
@@ -90,9 +738,10 @@ def ts_datetime(val):
 class Project:
     id: int
     name: str
+    wid: int = None
 
 
-@attr.s(auto_attribs=True)
+@attr.s(auto_attribs=True, slots=True)
 class ListTimeEntry:
     at: str
     billable: bool
@@ -107,15 +756,23 @@ class ListTimeEntry:
     uid: int
     wid: int
 
+    @classmethod
+    def from_json(cls, time_entry):
+        return cls(**{name: time_entry.get(name) for name in attr.fields_dict(cls)})
+
     @property
     def payload(self):
         return dict(
             id=self.id,
             description=self.description,
-            start=dateparser.parse(self.start).isoformat(),
+            start=parse_timestamp(self.start).isoformat(),
             duration=self.duration,
         )
 
+    @property
+    def start_date(self):
+        return parse_timestamp(self.start).astimezone(tzlocal()).date()
+
 
 @attr.s(auto_attribs=True)
 class CreateTimeEntry:
@@ -130,7 +787,7 @@ class CreateTimeEntry:
     def from_note(cls, project_id: int, start: datetime, note):
         return cls(
             pid=project_id,
-            jira_ref=note.ticket.ref if note.ticket else '',
+            jira_ref=note.jira_ref or '',
             description=note.description,
             duration=Duration(note.duration).to_seconds(),
             start=start,
@@ -155,6 +812,661 @@ class CreateTimeEntry:
         )
 
 
+class TokenBucket:
+    """Spaces out calls to `rate` per second, allowing bursts of `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Drains the bucket so the next call waits at least `seconds`."""
+        with self._lock:
+            self.tokens = -seconds * self.rate
+            self.updated = time.monotonic()
+
+
+@attr.s(auto_attribs=True)
+class WriteResult:
+    entry: CreateTimeEntry
+    status: int = None
+    id: int = None
+    error: str = None
+
+
+class TogglWriter:
+    """
+    Queues time entries and posts them over the session's keep-alive connection
+    at toggl's rate limit, backing off for `Retry-After` when throttled.
+    """
+
+    def __init__(
+        self, toggl, mirror=None, rate=TOGGL_REQUESTS_PER_SECOND, retries=TOGGL_RETRIES
+    ):
+        self.toggl = toggl
+        self.mirror = mirror
+        self.bucket = TokenBucket(rate)
+        self.retries = retries
+        self.queued = []
+
+    def queue(self, entry: CreateTimeEntry):
+        self.queued.append(entry)
+
+    def post(self, entry: CreateTimeEntry):
+        for _ in range(self.retries):
+            self.bucket.acquire()
+            try:
+                response = self.toggl.post('time_entries', json=entry.payload)
+            except requests.RequestException as e:
+                log.warning(f'Failed to post {entry}: {e}')
+                return WriteResult(entry, error=str(e))
+            if response.status_code != 429:
+                break
+            retry_after = float(response.headers.get('Retry-After', 1))
+            log.warning(f'Rate limited, retrying in {retry_after}s')
+            self.bucket.pause(retry_after)
+
+        if not response.ok:
+            return WriteResult(entry, response.status_code, error=response.text)
+        try:
+            time_entry = response.json()['data']
+            time_entry_id = time_entry['id']
+        except (ValueError, KeyError) as e:
+            log.warning(f'Unexpected response to {entry}: {e!r}')
+            return WriteResult(
+                entry, response.status_code, error=f'unexpected response: {e!r}'
+            )
+        if self.mirror:
+            self.mirror.upsert_time_entries([time_entry])
+        return WriteResult(entry, response.status_code, time_entry_id)
+
+    def flush(self):
+        results = [self.post(entry) for entry in self.queued]
+        self.queued = []
+        return results
+
+
+class IntervalIndex:
+    """
+    Half-open [start, end) intervals sorted by start, with a running maximum
+    of their ends so that overlap queries only walk back as far as an earlier
+    interval could still reach.
+    """
+
+    def __init__(self, intervals=()):
+        self.starts, self.ends, self.items = [], [], []
+        self._reach = None
+        for start, end, item in intervals:
+            self.add(start, end, item)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start, end, item=None):
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.items.insert(position, item)
+        self._reach = None
+
+    @property
+    def reach(self):
+        if self._reach is None:
+            self._reach = list(accumulate(self.ends, max))
+        return self._reach
+
+    def overlapping(self, start, end):
+        """Items whose intervals overlap [`start`, `end`)."""
+        found = []
+        position = bisect_left(self.starts, end) - 1
+        while position >= 0 and self.reach[position] > start:
+            if self.ends[position] > start:
+                found.append(self.items[position])
+            position -= 1
+        return found[::-1]
+
+    def overlaps(self):
+        """Every pair of overlapping intervals, in start order."""
+        return [
+            (self.items[position], self.items[other])
+            for position, end in enumerate(self.ends)
+            for other in range(position + 1, bisect_left(self.starts, end))
+        ]
+
+    def gaps(self, start, end):
+        """Uncovered [start, end) slots within the window."""
+        gaps, cursor = [], start
+        position = bisect_right(self.starts, start)
+        if position:
+            cursor = max(cursor, self.reach[position - 1])
+        for interval_start, interval_end in zip(
+            self.starts[position:], self.ends[position:]
+        ):
+            if cursor >= end or interval_start >= end:
+                break
+            if interval_start > cursor:
+                gaps.append((cursor, interval_start))
+            cursor = max(cursor, interval_end)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def covered(self, start, end):
+        """Seconds of the window covered by at least one interval."""
+        gaps = self.gaps(start, end)
+        return end - start - sum(gap_end - gap_start for gap_start, gap_end in gaps)
+
+    def free_slot(self, duration, start, end):
+        """
+        The start of the first gap in [`start`, `end`) that fits `duration`,
+        or else the first moment after everything that starts in the window.
+        """
+        for gap_start, gap_end in self.gaps(start, end):
+            if gap_end - gap_start >= duration:
+                return gap_start
+        position = bisect_left(self.starts, end)
+        return max(start, self.reach[position - 1]) if position else start
+
+
+class TimeEntryIndex:
+    """
+    Time entries by normalised (date, project, description, duration) for
+    exact duplicate checks, by (date, jira ref) for near matches and as a
+    per day `IntervalIndex` for placing new entries.
+    """
+
+    def __init__(self, time_entries=()):
+        self.entries = {}
+        self.by_ticket = defaultdict(list)
+        self.schedule = defaultdict(IntervalIndex)
+        for time_entry in time_entries:
+            self.add(time_entry)
+
+    @staticmethod
+    def key(date, pid, description, duration):
+        return (date, pid, ' '.join(description.split()).casefold(), int(duration))
+
+    def add(self, time_entry: ListTimeEntry):
+        self.add_entry(
+            time_entry.start_date,
+            time_entry.pid,
+            time_entry.description,
+            time_entry.duration,
+            time_entry,
+            start=parse_timestamp(time_entry.start),
+        )
+
+    def add_entry(self, date, pid, description, duration, time_entry=None, start=None):
+        self.entries[self.key(date, pid, description, duration)] = time_entry
+        for jira_ref in JIRA_REF_REGEX.findall(description):
+            self.by_ticket[(date, jira_ref)].append(time_entry or description)
+        # running entries have a negative duration
+        if start and duration > 0:
+            self.schedule[date].add(
+                epoch(start), epoch(start) + duration, time_entry or description
+            )
+
+    def contains(self, date, pid, description, duration):
+        return self.key(date, pid, description, duration) in self.entries
+
+    def same_ticket(self, date, description):
+        """Entries on `date` that mention any jira ref in `description`."""
+        return [
+            time_entry
+            for jira_ref in dict.fromkeys(JIRA_REF_REGEX.findall(description))
+            for time_entry in self.by_ticket.get((date, jira_ref), [])
+        ]
+
+    def free_slot(self, day, duration):
+        """Where an entry of `duration` fits into `day`'s working hours."""
+        slot = self.schedule[as_date(day)].free_slot(
+            duration, epoch(working_hours(day)), epoch(working_hours(day, 'end'))
+        )
+        return datetime.fromtimestamp(slot, tzlocal())
+
+
+def epoch(value):
+    """Seconds since the epoch for a datetime or date, naive ones being local."""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    return value.timestamp()
+
+
+@attr.s(auto_attribs=True, slots=True, frozen=True)
+class TimeEntryRecord:
+    id: int
+    start: datetime
+    duration: int
+    pid: int
+    description: str
+
+
+class TimeEntryColumns:
+    """
+    Time entries held column-wise in typed arrays, sorted by start epoch and
+    with descriptions interned, for analysis over long date ranges.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.starts = array('d')
+        self.durations = array('q')
+        self.pids = array('q')
+        self.description_ids = array('L')
+        self.descriptions = []
+        self._interned = {}
+
+    @classmethod
+    def from_json(cls, entries):
+        """Builds the columns from toggl's `time_entries` JSON, last id wins."""
+        rows = {
+            entry['id']: (
+                parse_timestamp(entry['start']).timestamp(),
+                entry['id'],
+                entry['duration'],
+                entry.get('pid') or 0,
+                entry.get('description') or '',
+            )
+            for entry in entries
+        }
+        columns = cls()
+        for start, entry_id, duration, pid, description in sorted(rows.values()):
+            columns.ids.append(entry_id)
+            columns.starts.append(start)
+            columns.durations.append(duration)
+            columns.pids.append(pid)
+            columns.description_ids.append(columns.intern(description))
+        return columns
+
+    def intern(self, description):
+        description_id = self._interned.get(description)
+        if description_id is None:
+            description_id = self._interned[description] = len(self.descriptions)
+            self.descriptions.append(description)
+        return description_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def __getitem__(self, row) -> TimeEntryRecord:
+        return TimeEntryRecord(
+            id=self.ids[row],
+            start=datetime.fromtimestamp(self.starts[row], tzlocal()),
+            duration=self.durations[row],
+            pid=self.pids[row],
+            description=self.descriptions[self.description_ids[row]],
+        )
+
+    @property
+    def total_duration(self):
+        return sum(self.durations)
+
+    def where(self, start=None, end=None, pid=None, jira_ref=None):
+        """
+        The entries starting in [`start`, `end`), optionally only those on
+        project `pid` or mentioning `jira_ref`.
+        """
+        rows = range(
+            0 if start is None else bisect_left(self.starts, epoch(start)),
+            len(self) if end is None else bisect_left(self.starts, epoch(end)),
+        )
+        if pid is not None:
+            rows = [row for row in rows if self.pids[row] == pid]
+        if jira_ref is not None:
+            description_ids = {
+                description_id
+                for description_id, description in enumerate(self.descriptions)
+                if jira_ref in JIRA_REF_REGEX.findall(description)
+            }
+            rows = [row for row in rows if self.description_ids[row] in description_ids]
+        return self.take(rows)
+
+    def take(self, rows):
+        """A new set of columns holding `rows`, sharing the description table."""
+        columns = type(self)()
+        columns.descriptions, columns._interned = self.descriptions, self._interned
+        for name in ['ids', 'starts', 'durations', 'pids', 'description_ids']:
+            column = getattr(self, name)
+            getattr(columns, name).extend(column[row] for row in rows)
+        return columns
+
+
+def days_between(start, end):
+    """Each date from `start` up to, but excluding, `end`."""
+    start, end = as_date(start), as_date(end)
+    return [start + timedelta(days=offset) for offset in range((end - start).days)]
+
+
+class HoursReport:
+    """
+    Totals over `TimeEntryColumns`, from a prefix sum of the duration column:
+    any day or week total is two bisects on the start column and a subtraction.
+    Running entries, which toggl reports with a negative duration, count as 0.
+    """
+
+    def __init__(self, columns: TimeEntryColumns):
+        self.columns = columns
+        self.durations = array(
+            'q', (max(duration, 0) for duration in columns.durations)
+        )
+        self.prefix = array('q', chain([0], accumulate(self.durations)))
+
+    def totals(self, boundaries):
+        """Seconds logged between each consecutive pair of `boundaries`."""
+        positions = [
+            bisect_left(self.columns.starts, epoch(boundary)) for boundary in boundaries
+        ]
+        return [
+            self.prefix[end] - self.prefix[start]
+            for start, end in zip(positions, positions[1:])
+        ]
+
+    def by_day(self, start, end):
+        days = days_between(start, end)
+        return list(zip(days, self.totals(days + [as_date(end)])))
+
+    def by_week(self, start, end):
+        """Totals per week, starting on the monday on or before `start`."""
+        monday = as_date(start) - timedelta(days=as_date(start).weekday())
+        mondays = days_between(monday, end)[::7]
+        if not mondays:
+            return []
+        return list(
+            zip(mondays, self.totals(mondays + [mondays[-1] + timedelta(weeks=1)]))
+        )
+
+    def by_project(self):
+        totals = defaultdict(int)
+        for pid, duration in zip(self.columns.pids, self.durations):
+            totals[pid] += duration
+        return dict(totals)
+
+    def by_ticket(self):
+        """Totals per jira ref, tallied per description and then split out."""
+        by_description = defaultdict(int)
+        for description_id, duration in zip(
+            self.columns.description_ids, self.durations
+        ):
+            by_description[description_id] += duration
+
+        totals = defaultdict(int)
+        for description_id, duration in by_description.items():
+            description = self.columns.descriptions[description_id]
+            for jira_ref in dict.fromkeys(JIRA_REF_REGEX.findall(description)):
+                totals[jira_ref] += duration
+        return dict(totals)
+
+    def short_days(self, start, end, expected=WORKING_DAY):
+        """Weekdays that don't add up to `expected`."""
+        return [
+            (day, total)
+            for day, total in self.by_day(start, end)
+            if day.weekday() < 5 and total != expected
+        ]
+
+    def short_weeks(self, start, end, expected=WORKING_WEEK):
+        """Whole weeks before `end` that fall short of `expected`."""
+        return [
+            (monday, total)
+            for monday, total in self.by_week(start, end)
+            if total < expected and monday + timedelta(weeks=1) <= as_date(end)
+        ]
+
+
+def hours(seconds):
+    return f'{seconds / HOUR:.2f}'
+
+
+class TogglMirror:
+    """
+    Local copy of toggl projects and time entries. After a first backfill,
+    `sync` only downloads what changed since its last cursor.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or CACHE_HOME.joinpath('toggl.sqlite'))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS time_entries ('
+                'id INTEGER PRIMARY KEY, start REAL, pid INTEGER, value TEXT)'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS time_entries_start '
+                'ON time_entries (start)'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS projects ('
+                'id INTEGER PRIMARY KEY, name TEXT, wid INTEGER)'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value REAL)'
+            )
+        self._project_index = None
+
+    def state(self, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM state WHERE key = ?', (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    @property
+    def cursor(self):
+        return self.state('cursor')
+
+    @property
+    def synced_from(self):
+        return self.state('synced_from')
+
+    def covers(self, start_date):
+        """Whether a synced mirror reaches back to `start_date`."""
+        return self.cursor is not None and self.synced_from <= epoch(start_date)
+
+    def upsert_time_entries(self, time_entries):
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO time_entries VALUES (?, ?, ?, ?)',
+                [
+                    (
+                        time_entry['id'],
+                        parse_timestamp(time_entry['start']).timestamp(),
+                        time_entry.get('pid'),
+                        json.dumps(time_entry),
+                    )
+                    for time_entry in time_entries
+                ],
+            )
+
+    def delete_time_entries(self, ids):
+        with self._lock, self._db:
+            self._db.executemany(
+                'DELETE FROM time_entries WHERE id = ?', [(id_,) for id_ in ids]
+            )
+
+    def upsert_projects(self, projects):
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO projects VALUES (?, ?, ?)',
+                [(project.id, project.name, project.wid) for project in projects],
+            )
+        self._project_index = None
+
+    def apply(self, time_entries=(), projects=()):
+        """Applies changed time entries and projects, dropping deleted entries."""
+        time_entries = list(time_entries)
+        deleted = [
+            time_entry['id']
+            for time_entry in time_entries
+            if time_entry.get('server_deleted_at')
+        ]
+        self.upsert_time_entries(
+            time_entry
+            for time_entry in time_entries
+            if not time_entry.get('server_deleted_at')
+        )
+        self.delete_time_entries(deleted)
+        self.upsert_projects(projects)
+        return len(time_entries) - len(deleted), len(deleted)
+
+    def replace(
+        self, start_date: datetime, end_date: datetime, time_entries, projects=()
+    ):
+        """
+        Makes [`start_date`, `end_date`) match a full fetch of that range,
+        dropping entries that are no longer there.
+        """
+        time_entries = list(time_entries)
+        fetched = {time_entry['id'] for time_entry in time_entries}
+        with self._lock:
+            deleted = [
+                id_
+                for id_, in self._db.execute(
+                    'SELECT id FROM time_entries WHERE start >= ? AND start < ?',
+                    (epoch(start_date), epoch(end_date)),
+                )
+                if id_ not in fetched
+            ]
+        self.delete_time_entries(deleted)
+        self.upsert_time_entries(time_entries)
+        self.upsert_projects(projects)
+        return len(time_entries), len(deleted)
+
+    def backfill(self, toggl, start_date: datetime):
+        end_date = datetime.now() + relativedelta(days=1)
+        return self.replace(
+            start_date,
+            end_date,
+            (
+                time_entry
+                for page in toggl.time_entry_pages(start_date, end_date)
+                for time_entry in page
+            ),
+            toggl.projects(),
+        )
+
+    def sync(self, toggl, start_date: datetime = None):
+        """
+        Backfills from `start_date` on the first sync, or when asked to reach
+        further back, and otherwise applies the changes since the cursor.
+        A cursor older than toggl reports changes for is caught up by fetching
+        its last `TOGGL_CHANGES_WINDOW` again.
+        Returns how many time entries were updated and deleted.
+        """
+        if self.cursor is None or (start_date and epoch(start_date) < self.synced_from):
+            start_date = start_date or datetime.now() + relativedelta(
+                months=-TOGGL_MIRROR_MONTHS
+            )
+            cursor = int(time.time())
+            changed = self.backfill(toggl, start_date)
+            synced_from = epoch(start_date)
+        elif time.time() - self.cursor > TOGGL_CHANGES_WINDOW:
+            cursor = int(time.time())
+            changed = self.backfill(
+                toggl, datetime.fromtimestamp(self.cursor - TOGGL_CHANGES_WINDOW)
+            )
+            synced_from = self.synced_from
+        else:
+            changes = toggl.changes(int(self.cursor))
+            data = changes.get('data') or {}
+            changed = self.apply(
+                data.get('time_entries') or [],
+                [
+                    Project(id=project['id'], name=project['name'], wid=project['wid'])
+                    for project in data.get('projects') or []
+                ],
+            )
+            cursor, synced_from = changes['since'], self.synced_from
+
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO state VALUES (?, ?)',
+                [('cursor', cursor), ('synced_from', synced_from)],
+            )
+        return changed
+
+    def rows(self, start_date: datetime, end_date: datetime):
+        with self._lock:
+            return [
+                json.loads(value)
+                for value, in self._db.execute(
+                    'SELECT value FROM time_entries '
+                    'WHERE start >= ? AND start < ? ORDER BY start',
+                    (epoch(start_date), epoch(end_date)),
+                )
+            ]
+
+    def time_entries(self, start_date: datetime, end_date: datetime):
+        return [
+            ListTimeEntry.from_json(time_entry)
+            for time_entry in self.rows(start_date, end_date)
+        ]
+
+    def time_entry_columns(self, start_date: datetime, end_date: datetime):
+        return TimeEntryColumns.from_json(self.rows(start_date, end_date))
+
+    def project_index(self):
+        if not self._project_index:
+            with self._lock:
+                projects = [
+                    Project(*row)
+                    for row in self._db.execute('SELECT id, name, wid FROM projects')
+                ]
+            self._project_index = ProjectIndex(projects)
+        return self._project_index
+
+    def get_project_by_id(self, project_id):
+        return self.project_index().by_id.get(project_id)
+
+    def stats(self):
+        with self._lock:
+            return [
+                [table, self._db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]]
+                for table in ['time_entries', 'projects']
+            ]
+
+
+def time_entry_source(settings, start_date: datetime):
+    """
+    The local mirror, brought up to date, when it reaches back to
+    `start_date`, otherwise toggl itself.
+    """
+    mirror = settings.mirror
+    if mirror and mirror.covers(start_date):
+        with PROFILER.span('sync', 'toggl mirror'):
+            mirror.sync(settings.toggl)
+        return mirror
+    return settings.toggl
+
+
+@lru_cache()
+def markdown_parser():
+    import mistune
+
+    return mistune.Markdown(renderer=mistune.AstRenderer())
+
+
 @attr.s(auto_attribs=True)
 class Standup:
     date: str
@@ -162,12 +1474,14 @@ class Standup:
     yesterday: List[str] = []
     today: List[str] = []
     blockers: List[str] = []
+    markdown: str = attr.ib(default='', repr=False)
 
     @classmethod
     def from_markdown(cls, markdown):
-        parsed_markdown = mistune.Markdown(renderer=mistune.AstRenderer())(markdown)
+        with PROFILER.span('parse', 'standup markdown', bytes=len(markdown)):
+            parsed_markdown = markdown_parser()(markdown)
         current_heading = None
-        categorised = defaultdict(list)
+        categorised = defaultdict(list, markdown=markdown)
 
         for markdown_item in parsed_markdown:
             if markdown_item['type'] == 'heading':
@@ -195,7 +1509,143 @@ class Standup:
                 break
             else:
                 print('Ignoring', markdown_item)
-        return Standup(**categorised)
+        sections = attr.fields_dict(cls)
+        for heading in set(categorised) - set(sections):
+            print('Ignoring', heading)
+        return cls(**{key: categorised[key] for key in categorised if key in sections})
+
+    def jira_refs(self, sections=('yesterday', 'today', 'blockers')):
+        """Unique jira references across `sections`, in order of appearance."""
+        return list(
+            dict.fromkeys(
+                jira_ref
+                for section in sections
+                for entry_text in getattr(self, section)
+                for jira_ref in JIRA_REF_REGEX.findall(entry_text)
+            )
+        )
+
+    def pull_request_refs(self, sections=('yesterday', 'today', 'blockers')):
+        """Unique (repo_name, pr_id) refs across `sections`, in order."""
+        return list(
+            dict.fromkeys(
+                ref
+                for section in sections
+                for entry_text in getattr(self, section)
+                for ref in Note.from_text(entry_text).pull_request_refs
+            )
+        )
+
+    @property
+    def hours(self):
+        """Hours worked, from a `# 2020-01-02 [6]` heading, defaulting to 8."""
+        has_hours = STANDUP_HOURS_REGEX.search(self.markdown.split('\n', 1)[0])
+        return int(has_hours.group('hours')) if has_hours else 8
+
+    @property
+    def comments(self):
+        """The standup's markdown below its date heading."""
+        return '\n'.join(self.markdown.rstrip().split('\n')[1:])
+
+
+class StandupRepository:
+    """
+    Standups under `home` by date, parsed once and cached by path, keeping the
+    file's mtime and content hash to tell when it needs parsing again.
+
+    A sorted index of standup dates comes from a single directory scan and is
+    only updated when the directory changes.
+    """
+
+    def __init__(self, home=STANDUP_HOME, cache=None):
+        self.home = Path(home)
+        self.cache = cache
+        self._dates = []
+        self._scanned_mtime = None
+
+    def path(self, day):
+        return self.home.joinpath(f'{day:%Y-%m-%d}.md')
+
+    def index(self):
+        """Sorted standup dates, rescanning `home` only after it changes."""
+        mtime = self.home.stat().st_mtime_ns if self.home.exists() else None
+        if mtime == self._scanned_mtime:
+            return self._dates
+
+        with os.scandir(self.home) as entries:
+            dates = {
+                datetime.strptime(entry.name[:-3], '%Y-%m-%d').date()
+                for entry in entries
+                if STANDUP_FILENAME_REGEX.match(entry.name) and entry.is_file()
+            }
+        known = set(self._dates)
+        for day in known - dates:
+            self._dates.remove(day)
+        for day in dates - known:
+            insort(self._dates, day)
+        self._scanned_mtime = mtime
+        return self._dates
+
+    def dates(self, start, end):
+        """Dates in [start, end] that have a standup."""
+        dates = self.index()
+        return dates[
+            bisect_left(dates, as_date(start)) : bisect_right(dates, as_date(end))
+        ]
+
+    def missing(self, start, end, weekdays=range(5)):
+        """Working days in [start, end] without a standup."""
+        present = set(self.dates(start, end))
+        days = (
+            as_date(start) + timedelta(days=offset)
+            for offset in range((as_date(end) - as_date(start)).days + 1)
+        )
+        return [day for day in days if day.weekday() in weekdays and day not in present]
+
+    def exists(self, day):
+        dates = self.index()
+        position = bisect_left(dates, as_date(day))
+        return position < len(dates) and dates[position] == as_date(day)
+
+    def standups(self, start, end):
+        """Standups in [start, end], by date."""
+        return self.get_many(self.dates(start, end))
+
+    def get(self, day):
+        path = self.path(day)
+        stat = path.stat()
+        cached = self.cache and self.cache.get(Standup.__name__, path)
+        if cached and [cached.value['mtime'], cached.value['size']] == [
+            stat.st_mtime_ns,
+            stat.st_size,
+        ]:
+            return Standup(**cached.value['standup'])
+
+        content = path.read_bytes()
+        digest = hashlib.sha1(content).hexdigest()
+        if cached and cached.value['digest'] == digest:
+            standup = Standup(**cached.value['standup'])
+        else:
+            standup = Standup.from_markdown(content.decode())
+
+        if self.cache:
+            self.cache.set(
+                Standup.__name__,
+                path,
+                dict(
+                    mtime=stat.st_mtime_ns,
+                    size=stat.st_size,
+                    digest=digest,
+                    standup=attr.asdict(standup),
+                ),
+                STANDUP_CACHE_TTL,
+            )
+        return standup
+
+    def get_many(self, days, max_workers=MAX_WORKERS):
+        """Reads and parses the standups for `days` in parallel."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(days, executor.map(self.get, days)))
 
 
 @attr.s(auto_attribs=True)
@@ -208,15 +1658,126 @@ class Ticket:
 
     @classmethod
     def from_ref(cls, jira, ref: str):
-        ticket = jira.get(f'issue/{ref}').json()
+        return jira.cached_record(
+            cls,
+            ref,
+            f'issue/{ref}',
+            lambda issue: cls.from_issue(dict(issue, key=ref)),
+            params=dict(fields=','.join(JIRA_FIELDS)),
+        )
+
+    @classmethod
+    def from_issue(cls, issue):
+        ref = issue['key']
         return cls(
             ref=ref,
             link=f'https://quidco.atlassian.net/browse/{ref}',
-            status=ticket['fields']['status']['name'],
-            title=ticket['fields']['summary'],
-            description=ticket['fields'].get('description') or '',
+            status=issue['fields']['status']['name'],
+            title=issue['fields']['summary'],
+            description=issue['fields'].get('description') or '',
         )
 
+    @property
+    def cache_ttl(self):
+        return CACHE_TTLS[
+            'done' if self.status in DONE_TICKET_STATUSES else 'in_progress'
+        ]
+
+
+class AsyncEngine:
+    """
+    Runs blocking session calls from asyncio on a thread pool, with at most
+    `concurrency` in flight per host. The calls go through the usual sessions,
+    so they keep their caching, and Ctrl-C cancels whatever hasn't started.
+    Each `run` has its own event loop, thread pool and per-host limits, so
+    runs can overlap or nest.
+    """
+
+    def __init__(self, concurrency=MAX_WORKERS):
+        self._concurrency = concurrency
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+    @concurrency.setter
+    def concurrency(self, concurrency):
+        self._concurrency = concurrency
+        shared_transport().resize(concurrency)
+
+    async def call(self, host, fetch, *args):
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            executor, semaphores = self._runs[loop]
+        semaphore = semaphores.get(host)
+        if semaphore is None:
+            semaphore = semaphores[host] = asyncio.Semaphore(self.concurrency)
+        async with semaphore:
+            return await loop.run_in_executor(executor, partial(fetch, *args))
+
+    def run(self, coroutine):
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency * HTTP_POOL_HOSTS)
+        with self._lock:
+            self._runs[loop] = (executor, {})
+        task = loop.create_task(coroutine)
+        try:
+            return loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            log.warning('Interrupted, cancelling outstanding requests')
+            task.cancel()
+            # fetches still finishing can interrupt the loop again
+            while not task.done():
+                try:
+                    loop.run_until_complete(task)
+                except (asyncio.CancelledError, KeyboardInterrupt):
+                    pass
+            if not task.cancelled():
+                task.exception()
+            raise
+        finally:
+            with self._lock:
+                del self._runs[loop]
+            executor.shutdown(wait=False)
+            loop.close()
+
+    def map(self, host, fetch, keys):
+        """Calls `fetch` once per key, concurrently, returning results by key."""
+        import asyncio
+
+        async def fetch_all():
+            return await asyncio.gather(*(self.call(host, fetch, key) for key in keys))
+
+        return dict(zip(keys, self.run(fetch_all())))
+
+
+ENGINE = AsyncEngine()
+
+
+def host_of(session):
+    return urlsplit(session.base_url).netloc
+
+
+def fetch_concurrently(fetch, keys, host=None):
+    """Calls `fetch` once per unique key through the `ENGINE`, by key."""
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    return ENGINE.map(host, fetch, keys)
+
+
+def resolve_tickets(jira, refs):
+    """Fetches each unique ref once, concurrently, returning tickets by ref."""
+    return fetch_concurrently(
+        lambda ref: Ticket.from_ref(jira, ref), refs, host_of(jira)
+    )
+
 
 @attr.s(auto_attribs=True)
 class PullRequest:
@@ -230,12 +1791,17 @@ class PullRequest:
 
     @classmethod
     def from_ref(cls, bitbucket, repo_name: str, pr_id: int):
-        old_org = ['quidco-web-app', 'quidco-packages']
-        org = 'john_pervanas' if repo_name in old_org else 'maplesyrupgroup'
+        org = bitbucket.org_for(repo_name)
         # TODO: gitlab
-        pull_request = bitbucket.get(
-            f'repositories/{org}/{repo_name}/pullrequests/{pr_id}'
-        ).json()
+        return bitbucket.cached_record(
+            cls,
+            f'{repo_name}#{pr_id}',
+            f'repositories/{org}/{repo_name}/pullrequests/{pr_id}',
+            lambda pull_request: cls.from_json(repo_name, pr_id, pull_request),
+        )
+
+    @classmethod
+    def from_json(cls, repo_name: str, pr_id: int, pull_request):
         return cls(
             repo_name=repo_name,
             pr_id=pr_id,
@@ -248,80 +1814,186 @@ class PullRequest:
             comments=int(pull_request['comment_count']),
         )
 
+    @property
+    def cache_ttl(self):
+        return CACHE_TTLS[
+            'done' if self.state in DONE_PULL_REQUEST_STATES else 'in_progress'
+        ]
+
+
+Token = namedtuple('Token', ['kind', 'value', 'start', 'end'])
+
+
+def tokenize(entry_text: str):
+    """Jira refs, pull request refs and durations in `entry_text`, in one pass."""
+    return [
+        Token(match.lastgroup, match.group(match.lastgroup), *match.span())
+        for match in NOTE_TOKEN_REGEX.finditer(entry_text)
+    ]
+
+
+def canonical_duration(duration):
+    """Spells `1h30`, `4hrs` or `45min` style durations as `1h30m`, `4h`, `45m`."""
+    parts = DURATION_PARTS_REGEX.fullmatch(duration)
+    hours, minutes = divmod(
+        int(parts['hours'] or 0) * 60 + int(parts['minutes'] or 0), 60
+    )
+    return (
+        ''.join(
+            f'{value}{unit}' for value, unit in ((hours, 'h'), (minutes, 'm')) if value
+        )
+        or '0m'
+    )
+
 
 @attr.s(auto_attribs=True)
 class Note:  # => TimeEntry => ListTimeEntry 🤷‍♂️
     text: str
     duration: str = None
     ticket: Ticket = None
+    jira_refs: List[str] = attr.Factory(list)
+    pull_request_refs: List[Tuple[str, int]] = attr.Factory(list)
+    tokens: List[Token] = attr.Factory(list)
 
     @classmethod
-    def from_text(cls, jira, bitbucket, entry_text: str):
+    def from_text(cls, entry_text: str, tickets: dict = None):
         """
+        Parses a standup line without any network calls, taking its ticket from
+        already resolved `tickets` (by ref) when given.
+
         - QWA Release Manager 1h
         - QCO-9452 rebuild event sourcing on kinesis 7h
         - QCO-9452 continue to rebuild event sourcing
         - TECH-548 TECH-562 TECH-561 🚀 merged kraken#9, kraken#11, kraken#12 4h
-        # TODO: a note has tickets and pullrequests
+        - QCO-9452 pairing 1h30m
         """
-        ticket = None
-        has_jira_ref = JIRA_REF_REGEX.search(entry_text)
-        if has_jira_ref:
-            jira_ref = has_jira_ref.groupdict()['jira_ref'].strip()
-            ticket = Ticket.from_ref(jira, jira_ref)
-            entry_text = entry_text.replace(jira_ref, '')
-            log.debug(ticket)
+        tokens = tokenize(entry_text)
+        jira_refs = list(
+            dict.fromkeys(token.value for token in tokens if token.kind == 'jira_ref')
+        )
+        pull_request_refs = list(
+            dict.fromkeys(
+                (repo_name, int(pr_id))
+                for repo_name, pr_id in (
+                    token.value.split('#')
+                    for token in tokens
+                    if token.kind == 'pull_request'
+                )
+            )
+        )
+        durations = [token for token in tokens if token.kind == 'duration']
+        first_jira_ref = next(
+            (token for token in tokens if token.kind == 'jira_ref'), None
+        )
 
-        # TODO: gitlab
-        # pull_request = None
-        # has_pr_ref = PULL_REQUEST_REGEX.search(entry_text)
-        # if has_pr_ref:
-        #     has_pr_ref = has_pr_ref.groupdict()
-        #     pull_request = PullRequest.from_ref(
-        #         bitbucket, has_pr_ref['repo_name'], int(has_pr_ref['pr_id'])
-        #     )
-
-        duration = None
-        has_duration = DURATION_REGEX.search(entry_text)
-        if has_duration:
-            duration = has_duration.groupdict()['duration']
-            entry_text = entry_text.replace(duration, '')
-
-        return cls(text=entry_text.strip(), ticket=ticket, duration=duration)
+        # the note's ticket leads its description and its duration trails it
+        stripped = [
+            token
+            for token in tokens
+            if token is first_jira_ref or (durations and token is durations[-1])
+        ]
+        text, position = [], 0
+        for token in stripped:
+            text.append(entry_text[position : token.start])
+            position = token.end
+        text.append(entry_text[position:])
+
+        note = cls(
+            text=' '.join(''.join(text).split()),
+            duration=canonical_duration(durations[-1].value) if durations else None,
+            jira_refs=jira_refs,
+            pull_request_refs=pull_request_refs,
+            tokens=tokens,
+        )
+        return note.resolve(tickets) if tickets else note
+
+    def resolve(self, tickets: dict):
+        if self.jira_refs:
+            self.ticket = tickets.get(self.jira_refs[0])
+            log.debug(self.ticket)
+        return self
+
+    @property
+    def jira_ref(self):
+        return self.jira_refs[0] if self.jira_refs else None
 
     @property
     def description(self):
-        return f'{self.ticket.ref} {self.text}' if self.ticket else self.text
+        return f'{self.jira_ref} {self.text}' if self.jira_ref else self.text
+
+
+def parse_notes(lines, tickets: dict = None):
+    """Parses standup lines into notes, leaving ticket resolution to the caller."""
+    with PROFILER.span('parse', 'notes'):
+        return [Note.from_text(line, tickets) for line in lines if line]
+
+
+Settings = namedtuple(
+    'Settings', ['toggl', 'slack', 'jira', 'bitbucket', 'standups', 'cache', 'mirror']
+)
 
 
 @click.option('--debug', help='Enables debug logging.', is_flag=True, default=False)
 @click.option('-c', '--no-cache', help='Ignore the cache.', is_flag=True, default=False)
+@click.option(
+    '--profile', help='Print where the time went.', is_flag=True, default=False
+)
+@click.option(
+    '--profile-output',
+    help='Also write a Chrome trace of the run to this file.',
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click.option(
+    '--concurrency',
+    type=click.IntRange(min=1),
+    default=MAX_WORKERS,
+    show_default=True,
+    help='Concurrent requests per host.',
+)
 @click.group(context_settings=dict(help_option_names=[u'-h', u'--help']))
 @click.pass_context
-def cli(ctx, debug: bool, no_cache: bool):
+def cli(
+    ctx,
+    debug: bool,
+    no_cache: bool,
+    profile: bool,
+    profile_output: str,
+    concurrency: int,
+):
     """Synthetic timesheets and approvals for toggl.com"""
+    import coloredlogs
+    from slacker import Slacker
+
     coloredlogs.install(
         fmt='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
         level=logging.DEBUG if debug else logging.INFO,
     )
+    start_profiling(ctx, profile, profile_output)
+    ENGINE.concurrency = concurrency
     if not ctx.obj:
-        ctx.obj = namedtuple(
-            'Settings', ['toggl', 'slack', 'jira', 'bitbucket', 'standup_home']
-        )(
-            standup_home=os.environ.get(
-                'STANDUP_HOME', Path.home().joinpath('Work/standups')
+        cache = LocalCache()
+        ctx.obj = Settings(
+            standups=StandupRepository(cache=cache),
+            toggl=TogglSession(
+                os.environ['TOGGL_TOKEN'], cache=None if no_cache else cache
+            ),
+            slack=Slacker(
+                os.environ['SLACK_TOKEN'], session=mount_transport(requests.Session())
+            ),
+            jira=JiraSession(
+                os.environ['JIRA_USER'],
+                os.environ['JIRA_TOKEN'],
+                cache=None if no_cache else cache,
             ),
-            toggl=TogglSession(os.environ['TOGGL_TOKEN']),
-            slack=Slacker(os.environ['SLACK_TOKEN']),
-            jira=JiraSession(os.environ['JIRA_USER'], os.environ['JIRA_TOKEN']),
             bitbucket=BitbucketSession(
-                os.environ['BITBUCKET_USER'], os.environ['BITBUCKET_TOKEN']
+                os.environ['BITBUCKET_USER'],
+                os.environ['BITBUCKET_TOKEN'],
+                cache=None if no_cache else cache,
             ),
+            cache=cache,
+            mirror=None if no_cache else TogglMirror(),
         )
-        if no_cache:
-            ctx.obj.jira._is_cache_disabled = (
-                ctx.obj.bitbucket._is_cache_disabled
-            ) = True
+        ctx.call_on_close(log_transport_stats)
 
 
 def to_ascii_table(data, fields=None):
@@ -347,13 +2019,10 @@ def to_ascii_table(data, fields=None):
 @click.pass_obj
 def list_timesheets(settings):
     # TODO: start and end args?
-    query_params = {
-        'start_date': local_iso(datetime.now() + relativedelta(days=-14)),
-        'end_date': local_iso(datetime.now()),
-    }
-    entries = settings.toggl.get('time_entries', params=query_params).json()
-
-    time_entries = [ListTimeEntry(**time_entry) for time_entry in entries]
+    start_date = datetime.now() + relativedelta(days=-14)
+    time_entries = time_entry_source(settings, start_date).time_entries(
+        start_date, datetime.now()
+    )
 
     print(to_ascii_table([time_entry.payload for time_entry in time_entries]))
     print(to_ascii_table(time_entries))
@@ -366,15 +2035,56 @@ def list_timesheets(settings):
 
 
 # TODO: wrap slacker
-def slack_user_id_by_email(slack, email):
-    users = slack.users.list().body['members']
-    users = [u for u in users if u['profile'].get('email') == email]
+def slack_users(slack):
+    """Streams the workspace roster a page at a time."""
+    cursor = None
+    while True:
+        body = slack.users.get(
+            'users.list', params=dict(limit=SLACK_PAGE_SIZE, cursor=cursor)
+        ).body
+        yield from body['members']
+
+        cursor = body.get('response_metadata', {}).get('next_cursor')
+        if not cursor:
+            break
+
+
+def slack_user_id_by_email(slack, email, cache=None):
+    from slacker import Error as SlackError
+
+    cached = cache and cache.get('SlackUser', email)
+    if cached and cached.fresh:
+        return cached.value
+
+    try:
+        user = slack.users.get('users.lookupByEmail', params=dict(email=email))
+        user_id = user.body['user']['id']
+    except SlackError as e:
+        if str(e) == 'users_not_found':
+            return None
+        log.debug(f'users.lookupByEmail unavailable ({e}), scanning users.list')
+        user_id, seen = None, {}
+        for user in slack_users(slack):
+            if user['profile'].get('email'):
+                seen[user['profile']['email']] = user['id']
+            if user['profile'].get('email') == email:
+                user_id = user['id']
+                break
+        if cache:
+            cache.set_many('SlackUser', seen, SLACK_USER_TTL)
 
-    user_id = users[0]['id'] if users else None
     # slack_avatar_url=users[0]['profile']['image_72']
+    if user_id and cache:
+        cache.set('SlackUser', email, user_id, SLACK_USER_TTL)
     return user_id
 
 
+def git_user_email():
+    from plumbum.cmd import git
+
+    return git['config', 'user.email']().strip()
+
+
 @cli.command('slack')
 @click.argument(
     'standup-date',
@@ -382,20 +2092,21 @@ def slack_user_id_by_email(slack, email):
     default=f'{datetime.now():%Y-%m-%d}',
 )
 @click.option(
-    '--channel-name', default=git['config', 'user.email']().strip(), show_default=True
+    '--channel-name', default=git_user_email, show_default='git config user.email'
 )
 @click.pass_obj
 def slack_post(settings, standup_date, channel_name):
-    settings.jira._is_cache_disabled = settings.bitbucket._is_cache_disabled = True
+    import inflect
 
-    markdown_standup_path = Path(settings.standup_home).joinpath(
-        f'{standup_date:%Y-%m-%d}.md'
-    )
-    standup = Standup.from_markdown(markdown_standup_path.read_text())
+    standup = settings.standups.get(standup_date)
     log.info(standup)
+    tickets = settings.jira.tickets_for(standup.jira_refs())
+    pull_requests_by_ref = settings.bitbucket.pull_requests_for(
+        standup.pull_request_refs()
+    )
 
     target = (
-        slack_user_id_by_email(settings.slack, channel_name)
+        slack_user_id_by_email(settings.slack, channel_name, settings.cache)
         if '@' in channel_name
         else channel_name
     )
@@ -437,9 +2148,7 @@ def slack_post(settings, standup_date, channel_name):
             )
         )
 
-        notes = [
-            Note.from_text(settings.jira, settings.bitbucket, item) for item in items
-        ]
+        notes = parse_notes(items, tickets)
         log.debug(f'Notes: {notes}')
 
         if not notes:
@@ -458,24 +2167,20 @@ def slack_post(settings, standup_date, channel_name):
             dict(type='section', text=dict(type='mrkdwn', text=notes_as_list))
         )
 
-        tickets = [
-            Ticket.from_ref(settings.jira, jira_ref)
-            for note in notes
-            for jira_ref in JIRA_REF_REGEX.findall(note.description)
-        ]
         context = [
             dict(
                 type='mrkdwn',
                 text=f':ticket: {ticket.link} {ticket.title} [*{ticket.status}*] ',
             )
-            for ticket in tickets
+            for ticket in (
+                tickets[jira_ref] for note in notes for jira_ref in note.jira_refs
+            )
         ]
 
-        # TODO: PRs
         pull_requests = [
-            PullRequest.from_ref(settings.bitbucket, repo_name, int(pr_id))
+            pull_requests_by_ref[ref]
             for note in notes
-            for repo_name, pr_id in PULL_REQUEST_REGEX.findall(note.description)
+            for ref in note.pull_request_refs
         ]
         context.extend(
             [
@@ -499,7 +2204,7 @@ def slack_post(settings, standup_date, channel_name):
     # TODO: consolemd.Renderer().render()
     log.debug(blocks)
 
-    if click.confirm(f'Post this standup note to {target}'):
+    if confirm(f'Post this standup note to {target}'):
         response = settings.slack.chat.post_message(
             target,
             text=f'Standup Post {standup_date:%Y-%m-%d}',
@@ -510,21 +2215,9 @@ def slack_post(settings, standup_date, channel_name):
         log.debug(response)
 
 
-@cli.command('store')
-@click.argument(
-    'standup_date',
-    type=click.DateTime(formats=["%Y-%m-%d"]),
-    default=f'{datetime.now():%Y-%m-%d}',
-)
-@click.pass_obj
-def store_timesheets(settings, standup_date):
-    # standup contains entries for the day before standup_date
-    standup = Standup.from_markdown(
-        Path(settings.standup_home).joinpath(f'{standup_date:%Y-%m-%d}.md').read_text()
-    )
-    log.info(standup)
-
-    timesheet_date = standup_date + relativedelta(
+def timesheet_date_for(standup_date: datetime):
+    """A standup contains entries for the working day before `standup_date`."""
+    return standup_date + relativedelta(
         # monday has lasts friday's times
         days=-3 if standup_date.weekday() == 0 else -1,
         hour=0,
@@ -533,25 +2226,20 @@ def store_timesheets(settings, standup_date):
         microsecond=0,
     )
 
-    params = dict(
-        start_date=local_iso(timesheet_date),
-        end_date=local_iso(timesheet_date + timedelta(days=1)),
-    )
-    time_entries = [
-        ListTimeEntry(**time_entry)
-        for time_entry in settings.toggl.get('time_entries', params=params).json()
-    ]
 
-    start = dateparser.parse(
-        f'{timesheet_date:%Y-%m-%d} {WORKING_HOURS["start"]}'
-    ).astimezone(tzlocal())
+def store_standup(settings, timesheet_date, standup, time_entry_index, writer=None):
+    """
+    Posts the entries in `standup` missing from `time_entry_index`, or queues
+    them on `writer` without prompting.
+    """
+    start = working_hours(timesheet_date)
     log.debug(f'{timesheet_date} => {start}')
     # TODO: prompt? OR list projects ?? how to reference in standup report?
 
     for entry_text in standup.yesterday:
         if not entry_text:
             continue
-        note = Note.from_text(settings.jira, settings.bitbucket, entry_text)
+        note = Note.from_text(entry_text)
         if not note.duration:
             raise Exception(f'Missing duration in "{entry_text}"')
 
@@ -569,11 +2257,285 @@ def store_timesheets(settings, standup_date):
 
         log.info(entry)
         description = entry.payload['time_entry']['description']
-        if description in [t.description for t in time_entries]:
+        entry_key = (timesheet_date.date(), entry.pid, description, entry.duration)
+        if time_entry_index.contains(*entry_key):
             log.info('Duplicate entry, skipping')
             continue
-
-        if click.confirm('Add this time entry'):
+        for similar_entry in time_entry_index.same_ticket(
+            timesheet_date.date(), description
+        ):
+            log.warning(f'Same ticket already recorded that day: {similar_entry}')
+
+        entry.start = time_entry_index.free_slot(timesheet_date, entry.duration)
+        if writer:
+            writer.queue(entry)
+            time_entry_index.add_entry(*entry_key, start=entry.start)
+        elif confirm(f'Add this time entry at {entry.start:%H:%M}'):
             response = settings.toggl.post('time_entries', json=entry.payload).json()
             pprint(response)
-            start += relativedelta(seconds=+entry.duration)
+            if settings.mirror and response.get('data'):
+                settings.mirror.upsert_time_entries([response['data']])
+            time_entry_index.add_entry(*entry_key, start=entry.start)
+
+
+@cli.command('store')
+@click.argument(
+    'standup_date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=f'{datetime.now():%Y-%m-%d}',
+)
+@click.option(
+    '--from',
+    'from_date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help='Backfill every standup from this date.',
+)
+@click.option(
+    '--to',
+    'to_date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help='Last standup date to backfill, defaults to today.',
+)
+@click.option(
+    '-y',
+    '--yes',
+    is_flag=True,
+    default=False,
+    help='Post every new entry without prompting.',
+)
+@click.pass_obj
+def store_timesheets(settings, standup_date, from_date, to_date, yes):
+    standup_dates = [standup_date]
+    if from_date:
+        to_date = to_date or datetime.now()
+        standup_dates = [
+            datetime.combine(day, datetime.min.time())
+            for day in settings.standups.dates(from_date, to_date)
+        ]
+        if not standup_dates:
+            log.info(f'No standups between {from_date:%Y-%m-%d} and {to_date:%Y-%m-%d}')
+            return
+
+    standups = settings.standups.get_many(standup_dates)
+    log.info(standups)
+
+    timesheet_dates = {
+        standup_date: timesheet_date_for(standup_date) for standup_date in standups
+    }
+    start_date = min(timesheet_dates.values())
+    time_entries = time_entry_source(settings, start_date).time_entries(
+        start_date, max(timesheet_dates.values()) + timedelta(days=1)
+    )
+    time_entry_index = TimeEntryIndex(time_entries)
+    writer = TogglWriter(settings.toggl, settings.mirror) if yes else None
+
+    for standup_date, standup in standups.items():
+        store_standup(
+            settings,
+            timesheet_dates[standup_date],
+            standup,
+            time_entry_index,
+            writer,
+        )
+
+    if writer and writer.queued:
+        results = writer.flush()
+        print(
+            AsciiTable(
+                [['start', 'duration', 'description', 'status', 'id']]
+                + [
+                    [
+                        result.entry.start.isoformat(),
+                        result.entry.duration,
+                        result.entry.description,
+                        result.status,
+                        result.id or result.error,
+                    ]
+                    for result in results
+                ]
+            ).table
+        )
+
+
+@cli.command('report')
+@click.option(
+    '--from',
+    'from_date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=f'{datetime.now() + relativedelta(months=-3):%Y-%m-%d}',
+    help='First day to report on, rounded back to its monday.',
+)
+@click.option(
+    '--to',
+    'to_date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=f'{datetime.now():%Y-%m-%d}',
+    help='Last day to report on, rounded forward to its sunday.',
+)
+@click.option(
+    '--by',
+    type=click.Choice(['day', 'week', 'project', 'ticket']),
+    multiple=True,
+    default=['week', 'project', 'ticket'],
+    show_default=True,
+)
+@click.pass_obj
+def report_hours(settings, from_date, to_date, by):
+    """Hours per day, week, project and ticket, flagging short days and weeks"""
+    if from_date > to_date:
+        raise click.BadParameter(
+            f'{from_date:%Y-%m-%d} is after --to {to_date:%Y-%m-%d}',
+            param_hint="'--from'",
+        )
+    start = from_date + relativedelta(days=-from_date.weekday())
+    end = to_date + relativedelta(days=7 - to_date.weekday())
+    source = time_entry_source(settings, start)
+    hours_report = HoursReport(source.time_entry_columns(start, end))
+
+    def project_name(pid):
+        project = pid and source.get_project_by_id(pid)
+        return project.name if project else str(pid or '')
+
+    tables = dict(
+        day=(['day', 'hours'], hours_report.by_day(start, end)),
+        week=(['week', 'hours'], hours_report.by_week(start, end)),
+        project=(
+            ['project', 'hours'],
+            sorted(
+                (
+                    (project_name(pid), total)
+                    for pid, total in hours_report.by_project().items()
+                ),
+                key=lambda row: -row[1],
+            ),
+        ),
+        ticket=(
+            ['ticket', 'hours'],
+            sorted(hours_report.by_ticket().items(), key=lambda row: -row[1]),
+        ),
+    )
+    for section in by:
+        headings, rows = tables[section]
+        print(
+            AsciiTable([headings] + [[key, hours(total)] for key, total in rows]).table
+        )
+
+    flag_end = to_date + relativedelta(days=1)
+    for title, short in [
+        (
+            f'Weekdays not {WORKING_DAY // HOUR}h',
+            hours_report.short_days(start, flag_end),
+        ),
+        (
+            f'Weeks under {WORKING_WEEK // HOUR}h',
+            hours_report.short_weeks(start, flag_end),
+        ),
+    ]:
+        if short:
+            click.secho(title, fg='yellow', bold=True)
+            print(
+                AsciiTable(
+                    [['date', 'hours']] + [[day, hours(total)] for day, total in short]
+                ).table
+            )
+
+
+def quarter_start(day):
+    return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+
+
+def clock_range(start, end):
+    return f'{datetime.fromtimestamp(start):%H:%M}-{datetime.fromtimestamp(end):%H:%M}'
+
+
+@cli.command('check')
+@click.option(
+    '--from',
+    'from_date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=f'{quarter_start(datetime.now()):%Y-%m-%d}',
+    help='First day to check, defaults to the start of this quarter.',
+)
+@click.option(
+    '--to',
+    'to_date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=f'{datetime.now():%Y-%m-%d}',
+    help='Last day to check.',
+)
+@click.pass_obj
+def check_time_entries(settings, from_date, to_date):
+    """Overlapping entries, gaps in working hours and short days"""
+    end_date = to_date + relativedelta(days=1)
+    time_entry_index = TimeEntryIndex(
+        time_entry_source(settings, from_date).time_entries(from_date, end_date)
+    )
+
+    rows = []
+    for day in days_between(from_date, end_date):
+        schedule = time_entry_index.schedule.get(day) or IntervalIndex()
+        if day.weekday() >= 5 and not schedule:
+            continue
+        total = sum(end - start for start, end in zip(schedule.starts, schedule.ends))
+        overlaps = schedule.overlaps()
+        gaps = schedule.gaps(
+            epoch(working_hours(day)), epoch(working_hours(day, 'end'))
+        )
+        if overlaps or gaps or total != WORKING_DAY:
+            rows.append(
+                [
+                    day,
+                    hours(total),
+                    '\n'.join(
+                        f'{first.description} / {second.description}'
+                        for first, second in overlaps
+                    ),
+                    '\n'.join(clock_range(start, end) for start, end in gaps),
+                ]
+            )
+
+    if rows:
+        print(AsciiTable([['date', 'hours', 'overlaps', 'gaps']] + rows).table)
+    else:
+        log.info(f'No overlaps, gaps or short days since {from_date:%Y-%m-%d}')
+
+
+@cli.command('sync')
+@click.option(
+    '--from',
+    'from_date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help=f'Backfill time entries from this date, defaults to '
+    f'{TOGGL_MIRROR_MONTHS} months back.',
+)
+@click.pass_obj
+def sync_time_entries(settings, from_date):
+    """Mirror toggl projects and time entries locally, fetching only changes"""
+    if not settings.mirror:
+        raise click.UsageError('sync needs the local cache, drop --no-cache')
+    updated, deleted = settings.mirror.sync(settings.toggl, from_date)
+    log.info(f'Synced {updated} updated and {deleted} deleted time entries')
+    print(AsciiTable([['table', 'rows']] + settings.mirror.stats()).table)
+
+
+@cli.group('cache')
+def cache_group():
+    """Inspect and prune the local ticket and pull request cache"""
+
+
+@cache_group.command('stats')
+@click.pass_obj
+def cache_stats(settings):
+    print(settings.cache.path)
+    print(
+        AsciiTable(
+            [['namespace', 'entries', 'fresh', 'bytes']] + settings.cache.stats()
+        ).table
+    )
+
+
+@cache_group.command('prune')
+@click.option('--namespace', help='Only prune this kind of record.')
+@click.pass_obj
+def cache_prune(settings, namespace):
+    log.info(f'Pruned {settings.cache.prune(namespace)} expired entries')
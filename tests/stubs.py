@@ -0,0 +1,368 @@
+"""
+Local stand-ins for the Toggl, Jira, Bitbucket, Slack and NaturalHR endpoints
+used by `synthetic` and `naturalhr`, with configurable latency and sizes.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+import attr
+from requests.adapters import HTTPAdapter
+
+
+@attr.s(auto_attribs=True)
+class StubConfig:
+    latency: float = 0.0
+    projects: int = 500
+    time_entries: int = 100
+    # entries reported as changed by each `me?since=` call
+    changed_time_entries: int = 2
+    slack_users: int = 2000
+    slack_lookup_by_email: bool = False
+    workflow_items: int = 50
+    # the only PHPSESSID naturalhr accepts, anything else goes to the login page
+    naturalhr_session: str = 'id'
+    timesheets: int = 12
+    time_off: int = 20
+    last_timesheet_entry: datetime = attr.Factory(
+        lambda: datetime.now() - timedelta(days=7)
+    )
+
+
+def page(body):
+    return f'<html><body>{body}</body></html>'
+
+
+def table(rows, header_rows=1):
+    headers = '<tr><th>heading</th></tr>' * header_rows
+    cells = (
+        '<tr>\n' + '\n'.join(f'<td>{cell}</td>' for cell in row) + '\n</tr>'
+        for row in rows
+    )
+    return f'<table>{headers}{"".join(cells)}</table>'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        service, _, path = url.path.lstrip('/').partition('/')
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        self.server.record(service, method, path)
+        time.sleep(self.server.config.latency)
+
+        handler = getattr(self, f'{service}_{method.lower()}', None)
+        status, payload, *headers = (
+            handler(path, params, body) if handler else (404, {})
+        )
+        content = (
+            payload.encode()
+            if isinstance(payload, str)
+            else json.dumps(payload).encode()
+        )
+        self.send_response(status)
+        self.send_header(
+            'Content-Type',
+            'text/html' if isinstance(payload, str) else 'application/json',
+        )
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers[0].items() if headers else ():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    @property
+    def config(self):
+        return self.server.config
+
+    # toggl
+    def toggl_time_entry(self, start, entry_id):
+        return dict(
+            at=start.isoformat() + '+00:00',
+            billable=False,
+            description=f'QCO-{entry_id} existing entry',
+            duration=3600,
+            duronly=False,
+            guid=f'guid-{entry_id}',
+            id=entry_id,
+            pid=1,
+            start=(start + timedelta(hours=entry_id)).isoformat() + '+00:00',
+            stop=(start + timedelta(hours=entry_id + 1)).isoformat() + '+00:00',
+            uid=1,
+            wid=1,
+        )
+
+    def toggl_get(self, path, params, body):
+        if path == 'api/v8/workspaces':
+            return 200, [dict(id=1, name='Workspace')]
+        if path == 'api/v8/workspaces/1/projects':
+            names = ['BAU - Q Platform', 'Holiday'] + [
+                f'Project {project_id}' for project_id in range(self.config.projects)
+            ]
+            return 200, [
+                dict(id=project_id, name=name, wid=1)
+                for project_id, name in enumerate(names, start=1)
+            ]
+        if path == 'api/v8/time_entries':
+            start = datetime.now() - timedelta(days=14)
+            return 200, [
+                self.toggl_time_entry(start, entry_id)
+                for entry_id in range(self.config.time_entries)
+            ]
+        if path == 'api/v8/me':
+            start = datetime.now() - timedelta(days=2)
+            return 200, dict(
+                since=int(time.time()),
+                data=dict(
+                    projects=[dict(id=1, name='BAU - Q Platform', wid=1)],
+                    time_entries=[
+                        dict(
+                            self.toggl_time_entry(start, entry_id),
+                            id=self.config.time_entries + entry_id,
+                        )
+                        for entry_id in range(self.config.changed_time_entries)
+                    ],
+                ),
+            )
+        return 404, {}
+
+    def toggl_post(self, path, params, body):
+        time_entry = json.loads(body)['time_entry']
+        return 200, dict(data=dict(time_entry, id=self.server.next_id()))
+
+    # jira
+    def jira_issue(self, key):
+        return dict(
+            key=key,
+            fields=dict(
+                summary=f'Summary of {key}',
+                status=dict(name='In Progress'),
+                description=f'Description of {key}',
+            ),
+        )
+
+    def jira_get(self, path, params, body):
+        if path == 'rest/api/latest/search':
+            keys = re.findall(r'[A-Z]+-[0-9]+', params['jql'])
+            return 200, dict(
+                issues=[self.jira_issue(key) for key in keys],
+                startAt=0,
+                maxResults=50,
+                total=len(keys),
+            )
+        issue = re.match(r'rest/api/latest/issue/(?P<key>[A-Z]+-[0-9]+)', path)
+        if issue:
+            return 200, self.jira_issue(issue['key'])
+        return 404, {}
+
+    # bitbucket
+    def bitbucket_get(self, path, params, body):
+        pull_request = re.match(
+            r'2.0/repositories/(?P<org>[^/]+)/(?P<repo>[^/]+)/pullrequests/(?P<id>\d+)',
+            path,
+        )
+        if not pull_request:
+            return 404, {}
+        return 200, dict(
+            links=dict(html=dict(href=f'https://bitbucket.org/{path}')),
+            title=f'Pull request {pull_request["id"]}',
+            state='OPEN',
+            participants=[dict(approved=True), dict(approved=False)],
+            comment_count=2,
+        )
+
+    # slack
+    def slack_user(self, user_id):
+        return dict(id=f'U{user_id}', profile=dict(email=f'user{user_id}@example.com'))
+
+    def slack_get(self, path, params, body):
+        if path == 'api/users.lookupByEmail':
+            if not self.config.slack_lookup_by_email:
+                return 200, dict(ok=False, error='missing_scope')
+            user_id = int(re.search(r'\d+', params['email']).group())
+            return 200, dict(ok=True, user=self.slack_user(user_id))
+        if path == 'api/users.list':
+            start = int(params.get('cursor') or 0)
+            end = min(start + int(params['limit']), self.config.slack_users)
+            next_cursor = str(end) if end < self.config.slack_users else ''
+            return 200, dict(
+                ok=True,
+                members=[self.slack_user(user_id) for user_id in range(start, end)],
+                response_metadata=dict(next_cursor=next_cursor),
+            )
+        return 200, dict(ok=False, error='unknown_method')
+
+    def slack_post(self, path, params, body):
+        return 200, dict(ok=True, ts='1.0')
+
+    # naturalhr
+    def week(self, week_number):
+        last = self.config.last_timesheet_entry
+        monday = last - timedelta(days=last.weekday())
+        return monday - timedelta(weeks=week_number)
+
+    def naturalhr_login(self, path):
+        """Sends requests without the accepted session cookie to the login page."""
+        cookie = f'PHPSESSID={self.config.naturalhr_session}'
+        if path == 'hr/login' or cookie in self.headers.get('Cookie', ''):
+            return None
+        return 302, page('login'), {'Location': '/naturalhr/hr/login?redirect=1'}
+
+    def naturalhr_get(self, path, params, body):
+        login = self.naturalhr_login(path)
+        if login:
+            return login
+        if path == 'hr/login':
+            return 200, page('login')
+        if path == 'hr/':
+            return 200, page('home')
+        if path == 'hr/self-service/timesheets/index':
+            return 200, page(
+                table(
+                    [
+                        f'{self.week(week):%d/%m/%Y}',
+                        'Week',
+                        '40h 0m',
+                        'Draft' if week == 0 else 'Approved',
+                        f'<a href="/hr/self-service/timesheets/timesheet-view/{week}">'
+                        f'view</a>',
+                    ]
+                    for week in range(self.config.timesheets)
+                )
+            )
+        if path.startswith('hr/self-service/timesheets/timesheet-view/'):
+            week = self.week(int(path.rsplit('/', 1)[1]))
+            days = (
+                week + timedelta(days=offset)
+                for offset in range(5)
+                if week + timedelta(days=offset) <= self.config.last_timesheet_entry
+            )
+            return 200, page(
+                table(
+                    [f'{day:%d/%m/%Y}', '0900', '1700', '60', 'Quidco BAU']
+                    for day in days
+                )
+            )
+        if path == 'hr/self-service/timesheets/timesheet-add':
+            options = ''.join(
+                f'<option value="{reference}">{reference}</option>'
+                for reference in ['', 'Quidco BAU', 'Off Project Work', 'Holiday']
+            )
+            return 200, page(f'<select id="reference">{options}</select>')
+        if path == 'hr/self-service/time-off':
+            start = datetime(2019, 1, 7)
+            return 200, page(
+                table(
+                    (
+                        [
+                            'Home Emergency',
+                            f'{start + timedelta(weeks=week):%d/%m/%Y}',
+                            f'{start + timedelta(weeks=week, days=2):%d/%m/%Y}',
+                            '3',
+                            'Days',
+                            'Approved',
+                            'Taken',
+                        ]
+                        for week in range(self.config.time_off)
+                    ),
+                    header_rows=2,
+                )
+            )
+        if path == 'hr/self-service/time-off-add':
+            return 200, page('<input type="hidden" name="emp_id" value="42">')
+        if path == 'hr/workflow-view':
+            items = ''.join(
+                '<div class="media-body">'
+                + (
+                    f'Jane Doe{item} submitted timesheet 06/01/2020'
+                    if item % 2
+                    else f'John Doe{item} requested to work from 06/01/2020'
+                )
+                + f' <a href="/hr/workflow-approve/{item}"></a></div>'
+                for item in range(self.config.workflow_items)
+            )
+            return 200, page(f'<div class="content">{items}</div>')
+        if path.startswith('hr/workflow-approve/'):
+            return 200, page(
+                '<input type="hidden" name="wb" value="06/01/2020">'
+                '<input type="hidden" name="weekTotal" value="144000">'
+                '<input type="radio" name="decision" value="1" checked>'
+            )
+        return 404, page('not found')
+
+    def naturalhr_post(self, path, params, body):
+        return self.naturalhr_login(path) or (200, page('ok'))
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """Serves every stub on one local port, counting requests per service."""
+
+    daemon_threads = True
+
+    def __init__(self, config=None):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.config = config or StubConfig()
+        self.requests = Counter()
+        self.paths = Counter()
+        self._ids = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def record(self, service, method, path):
+        with self._lock:
+            self.requests[service] += 1
+            self.paths[(service, method, path)] += 1
+
+    def next_id(self):
+        with self._lock:
+            self._ids += 1
+            return self._ids
+
+    def reset(self):
+        self.requests.clear()
+        self.paths.clear()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class RedirectAdapter(HTTPAdapter):
+    """Sends requests for a hardcoded host, like slack.com, to a stub."""
+
+    def __init__(self, prefix, target, transport):
+        super().__init__()
+        self.prefix = prefix
+        self.target = target
+        self.transport = transport
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace(self.prefix, self.target, 1)
+        return self.transport.send(request, **kwargs)
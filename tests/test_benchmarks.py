@@ -0,0 +1,344 @@
+"""
+End to end timings of each command against the local stubs in `stubs.py`.
+
+Every run is appended to $BENCHMARKS (a fresh temp file by default) as a JSON
+line with its wall time and request counts per service, and the request counts
+double as regression guards.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import naturalhr
+import pytest
+import requests
+import synthetic
+from click.testing import CliRunner
+from slacker import Slacker
+from stubs import RedirectAdapter, StubConfig, StubServer
+
+BENCHMARKS = os.environ.get('BENCHMARKS')
+STANDUP_DAYS = 30
+JIRA_REFS = 15
+PULL_REQUESTS = 6
+# `--help` may take this many times as long as starting a bare interpreter
+STARTUP_BUDGET = 8
+# imported by the commands that need them, never by `--help`
+DEFERRED_IMPORTS = [
+    'coloredlogs',
+    'dateparser',
+    'holidays',
+    'inflect',
+    'mistune',
+    'plumbum',
+    'pycookiecheat',
+    'requests_cache',
+    'requests_html',
+    'slacker',
+]
+
+
+@pytest.fixture(scope='module', autouse=True)
+def benchmarks(tmp_path_factory):
+    global BENCHMARKS
+    if not BENCHMARKS:
+        BENCHMARKS = tmp_path_factory.mktemp('benchmarks') / 'benchmarks.jsonl'
+
+
+@pytest.fixture(scope='module')
+def stub():
+    with StubServer(StubConfig(latency=0.002)) as server:
+        yield server
+
+
+@pytest.fixture
+def standups(tmp_path):
+    home = tmp_path.joinpath('standups')
+    home.mkdir()
+    refs = [f'QCO-{ref}' for ref in range(1, JIRA_REFS + 1)]
+    pull_requests = [f'kraken#{pr_id}' for pr_id in range(1, PULL_REQUESTS + 1)]
+    for offset in range(STANDUP_DAYS):
+        day = datetime.now() - timedelta(days=offset)
+        home.joinpath(f'{day:%Y-%m-%d}.md').write_text(
+            '\n'.join(
+                [f'# {day:%Y-%m-%d}', '', '## Yesterday', '']
+                + [f'- {ref} worked on {ref} 1h' for ref in refs[:8]]
+                + [f'- merged {", ".join(pull_requests)} 1h', '', '## Today', '']
+                + [f'- {ref} continue' for ref in refs[4:]]
+                + ['', '## Blockers', '', f'- {refs[0]} waiting on review', '']
+            )
+        )
+    return synthetic.StandupRepository(
+        home, synthetic.LocalCache(tmp_path.joinpath('standups.sqlite'))
+    )
+
+
+@pytest.fixture
+def settings(stub, standups, tmp_path):
+    cache = synthetic.LocalCache(tmp_path.joinpath('cache.sqlite'))
+    toggl = synthetic.TogglSession('token', cache=cache)
+    toggl.base_url = f'{stub.url}/toggl/api/v8/'
+    jira = synthetic.JiraSession('user', 'token', cache=cache)
+    jira.base_url = f'{stub.url}/jira/rest/api/latest/'
+    bitbucket = synthetic.BitbucketSession('user', 'token', cache=cache)
+    bitbucket.base_url = f'{stub.url}/bitbucket/2.0/'
+
+    slack_session = synthetic.mount_transport(requests.Session())
+    slack_session.mount(
+        'https://slack.com/',
+        RedirectAdapter(
+            'https://slack.com/', f'{stub.url}/slack/', synthetic.shared_transport()
+        ),
+    )
+    return synthetic.Settings(
+        toggl=toggl,
+        slack=Slacker('token', session=slack_session),
+        jira=jira,
+        bitbucket=bitbucket,
+        standups=standups,
+        cache=cache,
+        mirror=synthetic.TogglMirror(tmp_path.joinpath('toggl.sqlite')),
+    )
+
+
+@pytest.fixture
+def natural_hr(stub, standups, monkeypatch, tmp_path):
+    """Counts every time the chrome cookies are read."""
+    cookie_reads = []
+
+    def chrome_cookies(url):
+        cookie_reads.append(url)
+        return {naturalhr.NATURAL_HR_COOKIE: stub.config.naturalhr_session}
+
+    monkeypatch.setattr(naturalhr, 'NATURAL_HR', f'{stub.url}/naturalhr')
+    monkeypatch.setattr(naturalhr, 'chrome_cookies', chrome_cookies)
+    monkeypatch.setattr(
+        naturalhr,
+        'SESSIONS',
+        naturalhr.SessionManager(
+            synthetic.LocalCache(tmp_path.joinpath('credentials.sqlite'))
+        ),
+    )
+    monkeypatch.setattr(naturalhr, 'PAGES', naturalhr.PageCache())
+    monkeypatch.setattr(
+        naturalhr, 'leave_calendar', lru_cache()(naturalhr.leave_calendar.__wrapped__)
+    )
+    monkeypatch.setattr(naturalhr, 'standup_repository', lambda: standups)
+    monkeypatch.setattr(naturalhr.os, 'system', lambda command: 0)
+    monkeypatch.setattr(naturalhr, 'last_choice', None)
+    return cookie_reads
+
+
+def benchmark(stub, name, command, args, **kwargs):
+    stub.reset()
+    start = time.perf_counter()
+    result = CliRunner().invoke(command, args, **kwargs)
+    wall_time = time.perf_counter() - start
+    assert result.exit_code == 0, result.output
+
+    return record(
+        dict(
+            command=name,
+            wall_time=round(wall_time, 4),
+            requests=dict(stub.requests),
+            paths=len(stub.paths),
+        )
+    )
+
+
+def record(run):
+    run = dict(run, at=datetime.now().isoformat())
+    with open(BENCHMARKS, 'a') as benchmarks:
+        benchmarks.write(json.dumps(run) + '\n')
+    return run
+
+
+def test_synthetic_slack(stub, settings):
+    args = [
+        'slack',
+        f'{datetime.now():%Y-%m-%d}',
+        '--channel-name',
+        'user1999@example.com',
+    ]
+
+    cold = benchmark(
+        stub, 'synthetic slack', synthetic.cli, args, obj=settings, input='y\n'
+    )
+    assert cold['requests']['jira'] == 1
+    assert cold['requests']['bitbucket'] == PULL_REQUESTS
+    assert cold['requests']['slack'] == 1 + 10 + 1
+
+    warm = benchmark(
+        stub, 'synthetic slack (warm)', synthetic.cli, args, obj=settings, input='y\n'
+    )
+    assert warm['requests'] == dict(slack=1)
+
+
+def test_synthetic_store(stub, settings):
+    run = benchmark(
+        stub,
+        'synthetic store',
+        synthetic.cli,
+        ['store', f'{datetime.now():%Y-%m-%d}'],
+        obj=settings,
+        input='y\n' * 10,
+    )
+    # workspaces, projects, time entries and one post per line
+    assert run['requests'] == dict(toggl=3 + 9)
+
+
+def test_synthetic_list(stub, settings):
+    run = benchmark(stub, 'synthetic list', synthetic.cli, ['list'], obj=settings)
+    assert run['requests'] == dict(toggl=1)
+
+
+def test_synthetic_report(stub, settings):
+    run = benchmark(
+        stub,
+        'synthetic report',
+        synthetic.cli,
+        ['report', '--by', 'project'],
+        obj=settings,
+    )
+    # time entries, then workspaces and projects for the project names
+    assert run['requests'] == dict(toggl=3)
+
+
+def test_synthetic_sync_then_local_reads(stub, settings):
+    cold = benchmark(stub, 'synthetic sync', synthetic.cli, ['sync'], obj=settings)
+    # one range query, then workspaces and projects
+    assert cold['requests'] == dict(toggl=3)
+
+    for name, args in [
+        ('list', ['list']),
+        ('report', ['report', '--by', 'project']),
+        ('check', ['check']),
+    ]:
+        run = benchmark(
+            stub, f'synthetic {name} (synced)', synthetic.cli, args, obj=settings
+        )
+        # only the changes since the last sync
+        assert run['paths'] == 1 and run['requests'] == dict(toggl=1)
+
+    time_entries = settings.mirror.time_entries(
+        datetime.now() - timedelta(days=30), datetime.now()
+    )
+    assert (
+        len(time_entries) == stub.config.time_entries + stub.config.changed_time_entries
+    )
+
+
+def test_naturalhr_list(stub, natural_hr):
+    run = benchmark(stub, 'naturalhr list', naturalhr.synthetic, ['list'])
+    assert run['requests']['naturalhr'] <= 1 + 1 + 4
+
+
+def test_naturalhr_session_is_reused_until_redirected(stub, natural_hr, monkeypatch):
+    # pages are cached with the session, so skip them to see every request
+    args = ['--no-cache', 'list']
+    cold = benchmark(stub, 'naturalhr list', naturalhr.synthetic, args)
+    assert len(natural_hr) == 1
+    assert stub.paths[('naturalhr', 'GET', 'hr/')] == 1
+
+    def next_process():
+        monkeypatch.setattr(
+            naturalhr, 'SESSIONS', naturalhr.SessionManager(naturalhr.SESSIONS.cache)
+        )
+
+    next_process()
+    warm = benchmark(stub, 'naturalhr list (cached session)', naturalhr.synthetic, args)
+    assert len(natural_hr) == 1
+    assert stub.paths[('naturalhr', 'GET', 'hr/')] == 0
+    assert warm['requests']['naturalhr'] == cold['requests']['naturalhr'] - 1
+
+    # the cached session expired server side, so chrome is read once more
+    next_process()
+    monkeypatch.setattr(stub.config, 'naturalhr_session', 'rotated')
+    benchmark(stub, 'naturalhr list (expired session)', naturalhr.synthetic, args)
+    assert len(natural_hr) == 2
+
+
+def test_naturalhr_pages_are_cached_until_posted(stub, natural_hr):
+    cold = benchmark(stub, 'naturalhr list', naturalhr.synthetic, ['list'])
+    warm = benchmark(
+        stub, 'naturalhr list (cached pages)', naturalhr.synthetic, ['list']
+    )
+    assert cold['requests']['naturalhr'] > 0 and warm['requests'] == {}
+
+    session = naturalhr.get_session()
+    naturalhr.natural_api_post(
+        session,
+        f'{naturalhr.NATURAL_HR}/hr/self-service/timesheets/timesheet-add',
+        {'date': '01/01/2020'},
+    )
+    benchmark(stub, 'naturalhr list (after post)', naturalhr.synthetic, ['list'])
+    assert stub.paths[('naturalhr', 'GET', 'hr/self-service/timesheets/index')] == 1
+
+    no_cache = benchmark(
+        stub, 'naturalhr list (no cache)', naturalhr.synthetic, ['--no-cache', 'list']
+    )
+    # everything but the session check on /hr/
+    assert no_cache['requests']['naturalhr'] == cold['requests']['naturalhr'] - 1
+
+
+def test_naturalhr_approve(stub, natural_hr):
+    items = stub.config.workflow_items
+    run = benchmark(
+        stub, 'naturalhr approve', naturalhr.synthetic, ['approve'], input='y\n' * items
+    )
+    # home, workflow view, then one page fetch and one post per item
+    assert run['requests']['naturalhr'] == 2 + items * 2
+
+
+def test_naturalhr_store_missing_timesheets(stub, natural_hr):
+    run = benchmark(
+        stub, 'naturalhr store', naturalhr.synthetic, ['store'], input='0\n' * 20
+    )
+    assert run['requests']['naturalhr'] > 0
+    # the leave calendar is read once for the whole backfill
+    assert stub.paths[('naturalhr', 'GET', 'hr/self-service/time-off')] == 1
+
+
+def startup(code):
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', code],
+        env=dict(os.environ, PYTHONPATH='src'),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+    return time.perf_counter() - start, output
+
+
+def best_startup(code, runs=3):
+    return min(startup(code) for _ in range(runs))
+
+
+@pytest.mark.parametrize(
+    'module, command', [('synthetic', 'cli'), ('naturalhr', 'synthetic')]
+)
+def test_startup(module, command):
+    interpreter, _ = best_startup('pass')
+    wall_time, output = best_startup(
+        f'import sys, {module}\n'
+        f'try:\n'
+        f'    {module}.{command}(["--help"])\n'
+        f'except SystemExit:\n'
+        f'    print(sorted(set({DEFERRED_IMPORTS!r}) & set(sys.modules)))'
+    )
+    record(
+        dict(
+            command=f'{module} --help',
+            wall_time=round(wall_time, 4),
+            interpreter=round(interpreter, 4),
+        )
+    )
+    assert output.splitlines()[-1] == '[]'
+    assert wall_time <= interpreter * STARTUP_BUDGET
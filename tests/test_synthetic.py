@@ -1,8 +1,982 @@
+import asyncio
+import gc
+import json
+import os
+import re
+import stat
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+import click
+import naturalhr
+import pytest
+import requests
+import synthetic
 from click.testing import CliRunner
-from synthetic import cli
+from naturalhr import LeaveCalendar, TimeOff, TimeSheet
+from slacker import Error
+from synthetic import (
+    DAY,
+    HOUR,
+    JIRA_SEARCH_CHUNK,
+    WORKING_WEEK,
+    AsyncEngine,
+    BitbucketSession,
+    CreateTimeEntry,
+    HoursReport,
+    IntervalIndex,
+    JiraSession,
+    ListTimeEntry,
+    LocalCache,
+    Note,
+    Profiler,
+    Project,
+    ProjectIndex,
+    PullRequest,
+    Standup,
+    StandupRepository,
+    TimeEntryColumns,
+    TimeEntryIndex,
+    TogglMirror,
+    TogglSession,
+    TogglWriter,
+    cli,
+    mount_transport,
+    parse_notes,
+    parse_timestamp,
+    resolve_tickets,
+    shared_transport,
+    slack_user_id_by_email,
+    timesheet_date_for,
+    working_hours,
+)
+
+
+def fake_response(status_code=200, payload=None, headers=None):
+    """A `requests.Response` with `payload` as its JSON body."""
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = b'' if payload is None else json.dumps(payload).encode()
+    return response
 
 
 def test_help():
     result = CliRunner().invoke(cli, ['-h'], prog_name='synthetic')
     assert result.exit_code == 0
     assert 'Usage: synthetic' in result.output
+
+
+def test_standup_jira_refs_are_unique_across_sections():
+    standup = Standup(
+        date='2020-01-02',
+        yesterday=['QCO-1 one 1h', 'QCO-2 QCO-1 two 2h'],
+        today=['QCO-3 three', 'no ticket'],
+        blockers=['QCO-2'],
+    )
+    assert standup.jira_refs() == ['QCO-1', 'QCO-2', 'QCO-3']
+    assert standup.jira_refs(sections=['today']) == ['QCO-3']
+
+
+def test_resolve_tickets_fetches_each_ref_once_concurrently():
+    lock, fetched, in_flight = threading.Lock(), [], dict(now=0, peak=0)
+
+    class Jira(JiraSession):
+        def get(self, path, **kwargs):
+            ref = path.split('/')[1]
+            with lock:
+                fetched.append(ref)
+                in_flight['now'] += 1
+                in_flight['peak'] = max(in_flight['peak'], in_flight['now'])
+            time.sleep(0.02)
+            with lock:
+                in_flight['now'] -= 1
+            return fake_response(
+                payload=dict(fields=dict(summary=ref, status=dict(name='Done')))
+            )
+
+    tickets = resolve_tickets(
+        Jira('user', 'token'), ['QCO-1', 'QCO-2', 'QCO-1', 'QCO-3', 'QCO-2']
+    )
+    assert list(tickets) == ['QCO-1', 'QCO-2', 'QCO-3']
+    assert tickets['QCO-2'].title == 'QCO-2'
+    assert sorted(fetched) == ['QCO-1', 'QCO-2', 'QCO-3']
+    assert in_flight['peak'] > 1
+
+
+@pytest.mark.parametrize('validate_query', [True, False])
+def test_jira_tickets_for_batches_and_falls_back(validate_query):
+    def issue(key):
+        fields = dict(summary=key, status=dict(name='Done'), description='')
+        return dict(key=key, fields=fields)
+
+    class Jira(JiraSession):
+        def __init__(self):
+            super().__init__('user', 'token')
+            self.calls = []
+
+        def get(self, path, params=None, **kwargs):
+            if path.startswith('issue/'):
+                self.calls.append(path)
+                return fake_response(200, issue(path.split('/')[1]))
+            keys = re.findall(r'[A-Z]+-[0-9]+', params['jql'])
+            self.calls.append(len(keys))
+            if 'QCO-0' in keys and not (
+                validate_query and params['validateQuery'] == 'warn'
+            ):
+                message = "An issue with key 'QCO-0' does not exist for field 'key'."
+                return fake_response(400, dict(errorMessages=[message]))
+            found = [issue(key) for key in keys if key != 'QCO-0']
+            return fake_response(200, dict(issues=found, total=len(found)))
+
+    refs = [f'QCO-{ref}' for ref in range(JIRA_SEARCH_CHUNK + 10)]
+    jira = Jira()
+    tickets = jira.tickets_for(refs + refs[:5])
+    assert list(tickets) == refs
+    assert tickets['QCO-7'].title == 'QCO-7'
+
+    rejected = [] if validate_query else [JIRA_SEARCH_CHUNK - 1]
+    # one search per chunk, a rejected chunk searched again without the named
+    # key, which is then fetched on its own
+    assert jira.calls == ([JIRA_SEARCH_CHUNK] + rejected + [10] + ['issue/QCO-0'])
+
+
+def test_local_cache_expiry_and_prune(tmp_path):
+    cache = LocalCache(tmp_path.joinpath('cache.sqlite'))
+    cache.set('Ticket', 'QCO-1', dict(status='Done'), ttl=60, etag='"abc"')
+    cache.set('Ticket', 'QCO-2', dict(status='In Progress'), ttl=-1)
+
+    assert cache.get('Ticket', 'QCO-1').fresh
+    assert cache.get('Ticket', 'QCO-1').validators == {'If-None-Match': '"abc"'}
+    assert not cache.get('Ticket', 'QCO-2').fresh
+    assert cache.get('Ticket', 'QCO-3') is None
+
+    cache.touch('Ticket', 'QCO-2', ttl=60)
+    assert cache.get('Ticket', 'QCO-2').fresh
+
+    cache.set('PullRequest', 'kraken#9', dict(state='OPEN'), ttl=-1)
+    assert cache.prune() == 1
+    assert [row[:3] for row in cache.stats()] == [('Ticket', 2, 2)]
+
+
+def test_project_index_lookups_across_workspaces():
+    index = ProjectIndex(
+        [
+            Project(id=1, name='BAU - Q Platform', wid=10),
+            Project(id=2, name='Holiday', wid=10),
+            Project(id=3, name='Holiday', wid=20),
+        ]
+    )
+    assert index.get('Holiday').id == 2
+    assert index.get('Holiday', workspace_id=20).id == 3
+    assert index.get('Missing') is None
+    assert index.by_id[1].name == 'BAU - Q Platform'
+
+
+def test_toggl_project_index_is_cached_and_refreshed_on_a_miss(tmp_path):
+    workspaces = {1: ['BAU', 'Holiday'], 2: ['BAU']}
+
+    class Toggl(TogglSession):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.calls = []
+
+        def get(self, path, **kwargs):
+            self.calls.append(path)
+            if path == 'workspaces':
+                return fake_response(payload=[dict(id=wid) for wid in workspaces])
+            wid = int(path.split('/')[1])
+            return fake_response(
+                payload=[
+                    dict(id=wid * 100 + offset, name=name)
+                    for offset, name in enumerate(workspaces[wid])
+                ]
+            )
+
+    fetch_all = ['workspaces', 'workspaces/1/projects', 'workspaces/2/projects']
+    cache = LocalCache(tmp_path.joinpath('cache.sqlite'))
+    toggl = Toggl('token', cache=cache)
+    assert toggl.get_project('BAU').id == 100
+    assert toggl.get_project('BAU', workspace_id=2).id == 200
+    assert toggl.calls == fetch_all
+
+    # the next process reads the index from the cache
+    toggl = Toggl('token', cache=cache)
+    assert toggl.get_project('Holiday').id == 101
+    assert toggl.calls == []
+
+    # a miss rebuilds the index, but only once per process
+    workspaces[2].append('Training')
+    assert toggl.get_project('Training').id == 201
+    assert toggl.get_project('Missing') is None
+    assert toggl.get_project_by_id(201).name == 'Training'
+    assert toggl.calls == fetch_all
+
+    # once the TTL runs out the index is fetched again
+    cache.touch(ProjectIndex.__name__, 'projects', -1)
+    toggl = Toggl('token', cache=cache)
+    assert toggl.get_project('Training').wid == 2
+    assert toggl.calls == fetch_all
+
+
+def test_toggl_time_entries_ignore_unknown_fields():
+    entry = dict(
+        id=1,
+        pid=10,
+        description='QCO-1 rebuild',
+        duration=3600,
+        start='2020-03-03T09:00:00+00:00',
+        tags=['billable'],
+        server_deleted_at=None,
+    )
+
+    class Toggl(TogglSession):
+        def get(self, path, **kwargs):
+            return fake_response(payload=[entry, entry])
+
+    start = datetime(2020, 3, 3, tzinfo=timezone.utc)
+    time_entries = Toggl('token').time_entries(start, start + timedelta(days=1))
+    assert [(e.id, e.description, e.stop) for e in time_entries] == [
+        (1, 'QCO-1 rebuild', None)
+    ]
+
+
+def test_timesheet_date_for_monday_is_friday():
+    assert timesheet_date_for(datetime(2020, 3, 2, 9, 30)) == datetime(2020, 2, 28)
+    assert timesheet_date_for(datetime(2020, 3, 4)) == datetime(2020, 3, 3)
+
+
+def test_store_backfills_each_standup_in_range(tmp_path, monkeypatch):
+    home = tmp_path.joinpath('standups')
+    home.mkdir()
+    for day in ['2020-03-02', '2020-03-03', '2020-03-05', '2020-03-10']:
+        home.joinpath(f'{day}.md').write_text(STANDUP)
+
+    class Toggl:
+        calls = []
+
+        def time_entries(self, start_date, end_date):
+            self.calls.append((start_date, end_date))
+            return []
+
+    stored = []
+    monkeypatch.setattr(
+        synthetic,
+        'store_standup',
+        lambda settings, timesheet_date, *args, **kwargs: stored.append(timesheet_date),
+    )
+    settings = synthetic.Settings(
+        toggl=Toggl(),
+        slack=None,
+        jira=None,
+        bitbucket=None,
+        standups=synthetic.StandupRepository(home),
+        cache=None,
+        mirror=None,
+    )
+
+    def store(*args):
+        result = CliRunner().invoke(cli, ['store', *args], obj=settings)
+        assert result.exit_code == 0, result.output
+
+    store('--from', '2020-03-02', '--to', '2020-03-06')
+    # monday's standup has friday's times
+    assert stored == [datetime(2020, 2, 28), datetime(2020, 3, 2), datetime(2020, 3, 4)]
+    # one range query for the whole backfill
+    assert Toggl.calls == [(datetime(2020, 2, 28), datetime(2020, 3, 5))]
+
+    stored.clear()
+    store('--from', '2020-04-01', '--to', '2020-04-03')
+    assert stored == [] and len(Toggl.calls) == 1
+
+
+def test_parse_timestamp_fast_path_and_fallback():
+    utc = datetime(2020, 1, 2, 8, 30, tzinfo=timezone.utc)
+    assert parse_timestamp('2020-01-02T08:30:00+00:00') == utc
+    assert parse_timestamp('2020-01-02T08:30:00.000Z') == utc
+
+    assert parse_timestamp('2 January 2020 8:30am').replace(tzinfo=None) == (
+        utc.replace(tzinfo=None)
+    )
+
+    start = working_hours(datetime(2020, 1, 2))
+    assert (start.date(), start.hour, start.minute) == (utc.date(), 10, 0)
+    assert start.tzinfo is not None
+    assert working_hours(datetime(2020, 1, 2)) is start
+
+
+def test_time_entry_index_exact_and_same_ticket_matches():
+    time_entry = ListTimeEntry(
+        at='2020-03-03T18:00:00+00:00',
+        billable=False,
+        description='QCO-1  Rebuild event sourcing',
+        duration=3600,
+        duronly=False,
+        guid='guid',
+        id=1,
+        pid=10,
+        start='2020-03-03T12:00:00+00:00',
+        stop='2020-03-03T13:00:00+00:00',
+        uid=1,
+        wid=1,
+    )
+    index = TimeEntryIndex([time_entry])
+    day = date(2020, 3, 3)
+
+    assert index.contains(day, 10, 'QCO-1 rebuild event sourcing', 3600)
+    assert not index.contains(day, 10, 'QCO-1 rebuild event sourcing', 1800)
+    assert not index.contains(
+        date(2020, 3, 4), 10, 'QCO-1 rebuild event sourcing', 3600
+    )
+    assert index.same_ticket(day, 'QCO-1 review') == [time_entry]
+    assert index.same_ticket(day, 'QCO-2 review') == []
+
+
+def test_time_entry_columns_filtering():
+    def entry(entry_id, day, pid, description, duration=3600):
+        return dict(
+            id=entry_id,
+            start=f'2020-03-{day:02d}T12:00:00+00:00',
+            duration=duration,
+            pid=pid,
+            description=description,
+        )
+
+    columns = TimeEntryColumns.from_json(
+        [
+            entry(3, 4, 10, 'QCO-1 review'),
+            entry(1, 2, 10, 'QCO-1 rebuild'),
+            entry(2, 3, 20, 'QCO-2 deploy', 1800),
+            entry(4, 5, 10, 'QCO-1 rebuild'),
+            entry(3, 4, 10, 'QCO-1 review', 7200),
+        ]
+    )
+
+    assert list(columns.ids) == [1, 2, 3, 4]
+    assert columns.descriptions == ['QCO-1 rebuild', 'QCO-2 deploy', 'QCO-1 review']
+    assert columns.total_duration == 3600 + 1800 + 7200 + 3600
+
+    record = columns[2]
+    assert (record.id, record.duration, record.description) == (3, 7200, 'QCO-1 review')
+    assert record.start == datetime(2020, 3, 4, 12, tzinfo=timezone.utc)
+    assert not hasattr(record, '__dict__')
+
+    utc = timezone.utc
+    in_range = columns.where(
+        datetime(2020, 3, 3, tzinfo=utc), datetime(2020, 3, 5, tzinfo=utc)
+    )
+    assert list(in_range.ids) == [2, 3]
+    assert list(columns.where(pid=10).ids) == [1, 3, 4]
+    assert list(
+        columns.where(jira_ref='QCO-1', end=datetime(2020, 3, 5, tzinfo=utc)).ids
+    ) == [1, 3]
+    assert [r.description for r in columns.where(jira_ref='QCO-2')] == ['QCO-2 deploy']
+
+
+def test_hours_report_totals_and_short_days():
+    def entry(entry_id, day, hour, duration, description, pid=10):
+        return dict(
+            id=entry_id,
+            start=f'2020-03-{day:02d}T{hour:02d}:00:00',
+            duration=duration * HOUR,
+            pid=pid,
+            description=description,
+        )
+
+    entries = [
+        entry(day * 10 + 1, day, 9, 6, 'QCO-1 rebuild') for day in range(2, 7)
+    ] + [entry(day * 10 + 2, day, 15, 2, 'QCO-2 review', 20) for day in range(2, 6)]
+    # monday the 9th is short, and a running entry counts as nothing
+    entries += [entry(91, 9, 9, 4, 'QCO-1 QCO-3 pair'), entry(92, 9, 13, -1, 'QCO-3')]
+    report = HoursReport(TimeEntryColumns.from_json(entries))
+
+    assert report.by_day(date(2020, 3, 5), date(2020, 3, 8)) == [
+        (date(2020, 3, 5), 8 * HOUR),
+        (date(2020, 3, 6), 6 * HOUR),
+        (date(2020, 3, 7), 0),
+    ]
+    assert report.by_week(date(2020, 3, 4), date(2020, 3, 10)) == [
+        (date(2020, 3, 2), 38 * HOUR),
+        (date(2020, 3, 9), 4 * HOUR),
+    ]
+    assert report.by_week(date(2020, 3, 4), date(2020, 3, 1)) == []
+    assert report.by_project() == {10: 34 * HOUR, 20: 8 * HOUR}
+    assert report.by_ticket() == {
+        'QCO-1': 34 * HOUR,
+        'QCO-2': 8 * HOUR,
+        'QCO-3': 4 * HOUR,
+    }
+    assert report.short_days(date(2020, 3, 2), date(2020, 3, 10)) == [
+        (date(2020, 3, 6), 6 * HOUR),
+        (date(2020, 3, 9), 4 * HOUR),
+    ]
+    assert report.short_weeks(date(2020, 3, 2), date(2020, 3, 10)) == [
+        (date(2020, 3, 2), 38 * HOUR)
+    ]
+
+    result = CliRunner().invoke(
+        cli, ['report', '--from', '2020-03-10', '--to', '2020-03-01'], obj=object()
+    )
+    assert result.exit_code == 2
+    assert "Invalid value for '--from'" in result.output
+
+
+def test_naturalhr_timesheet_hours():
+    assert TimeSheet('06/01/2020', 'Draft', '40h 0m').seconds == WORKING_WEEK
+    assert TimeSheet('06/01/2020', 'Draft', '39h 45m').seconds < WORKING_WEEK
+
+
+def test_toggl_mirror_incremental_sync(tmp_path):
+    def time_entry(entry_id, **fields):
+        start = datetime(2020, 3, 2, 9) + timedelta(days=entry_id)
+        return dict(id=entry_id, start=start.isoformat(), pid=10, **fields)
+
+    class Toggl:
+        def __init__(self):
+            self.calls = []
+
+        def time_entry_pages(self, start_date, end_date):
+            self.calls.append('time_entries')
+            yield [time_entry(1), time_entry(2), time_entry(3)]
+
+        def projects(self):
+            self.calls.append('projects')
+            return [Project(10, 'BAU', 1)]
+
+        def changes(self, since):
+            self.calls.append(('me', since))
+            return dict(
+                since=since + 60,
+                data=dict(
+                    time_entries=[
+                        time_entry(2, description='edited'),
+                        time_entry(3, server_deleted_at='2020-03-06T00:00:00'),
+                        time_entry(4),
+                    ]
+                ),
+            )
+
+    toggl, mirror = Toggl(), TogglMirror(tmp_path.joinpath('toggl.sqlite'))
+    assert not mirror.covers(datetime(2020, 3, 1))
+
+    assert mirror.sync(toggl, datetime(2020, 3, 1)) == (3, 0)
+    assert mirror.covers(datetime(2020, 3, 1))
+    assert not mirror.covers(datetime(2020, 2, 1))
+    cursor = mirror.cursor
+
+    assert mirror.sync(toggl) == (2, 1)
+    assert toggl.calls == ['projects', 'time_entries', ('me', int(cursor))]
+    assert mirror.cursor == cursor + 60
+
+    time_entries = mirror.time_entries(datetime(2020, 3, 1), datetime(2020, 4, 1))
+    assert [(e.id, e.description) for e in time_entries] == [
+        (1, None),
+        (2, 'edited'),
+        (4, None),
+    ]
+    assert mirror.get_project_by_id(10).name == 'BAU'
+
+
+def test_toggl_mirror_refetches_when_the_cursor_is_too_old(tmp_path):
+    now = datetime.now()
+
+    def time_entry(entry_id, days_ago, **fields):
+        start = now - timedelta(days=days_ago)
+        return dict(id=entry_id, start=start.isoformat(), pid=10, **fields)
+
+    class Toggl:
+        def __init__(self, time_entries):
+            self.time_entries, self.calls = time_entries, []
+
+        def time_entry_pages(self, start_date, end_date):
+            self.calls.append(
+                ('time_entries', round((now - start_date).total_seconds() / DAY))
+            )
+            yield [
+                time_entry
+                for time_entry in self.time_entries
+                if start_date <= parse_timestamp(time_entry['start']) < end_date
+            ]
+
+        def projects(self):
+            return []
+
+        def changes(self, since):
+            self.calls.append('me')
+            return dict(since=since, data={})
+
+    mirror = TogglMirror(tmp_path.joinpath('toggl.sqlite'))
+    mirror.sync(
+        Toggl([time_entry(1, 40), time_entry(2, 12), time_entry(3, 5)]),
+        now - timedelta(days=60),
+    )
+    with mirror._db:
+        mirror._db.execute(
+            "UPDATE state SET value = ? WHERE key = 'cursor'", (time.time() - 15 * DAY,)
+        )
+
+    # 2 was deleted, 3 edited and 4 added more than 9 days after the cursor
+    toggl = Toggl(
+        [
+            time_entry(1, 40),
+            time_entry(3, 5, description='edited'),
+            time_entry(4, 2),
+        ]
+    )
+    assert mirror.sync(toggl) == (2, 1)
+    assert toggl.calls == [('time_entries', 24)]
+    assert mirror.cursor >= time.time() - 60
+
+    time_entries = mirror.time_entries(now - timedelta(days=60), now)
+    assert [(e.id, e.description) for e in time_entries] == [
+        (1, None),
+        (3, 'edited'),
+        (4, None),
+    ]
+
+
+def test_interval_index_overlaps_gaps_and_free_slots():
+    index = IntervalIndex([(10, 12, 'a'), (11, 13, 'b'), (15, 16, 'c'), (0, 30, 'd')])
+
+    assert index.overlapping(12, 15) == ['d', 'b']
+    assert index.overlapping(16, 20) == ['d']
+    assert index.overlaps() == [
+        ('d', 'a'),
+        ('d', 'b'),
+        ('d', 'c'),
+        ('a', 'b'),
+    ]
+
+    day = IntervalIndex([(10, 12, 'a'), (11, 13, 'b'), (15, 16, 'c')])
+    assert day.gaps(9, 18) == [(9, 10), (13, 15), (16, 18)]
+    assert day.gaps(11, 14) == [(13, 14)]
+    assert day.covered(9, 18) == 4
+    assert day.free_slot(1, 10, 18) == 13
+    assert day.free_slot(2, 10, 18) == 13
+    assert day.free_slot(3, 10, 16) == 16
+    assert IntervalIndex().free_slot(3, 10, 16) == 10
+
+
+def test_time_entry_index_places_entries_in_free_slots():
+    day = datetime(2020, 3, 3)
+    index = TimeEntryIndex()
+    start = working_hours(day)
+    index.add_entry(day.date(), 10, 'QCO-1 standup', HOUR, start=start)
+
+    slot = index.free_slot(day, 2 * HOUR)
+    assert slot == start.replace(hour=start.hour + 1)
+    index.add_entry(day.date(), 10, 'QCO-2 review', 2 * HOUR, start=slot)
+    assert index.free_slot(day, HOUR) == start.replace(hour=start.hour + 3)
+
+
+def test_naturalhr_store_skips_overlapping_entries(monkeypatch):
+    posted = []
+    monkeypatch.setattr(
+        naturalhr,
+        'natural_api_post',
+        lambda session, url, params: posted.append(params),
+    )
+    existing = naturalhr.TimeSheetEntry(
+        '06/01/2020', '07/01/2020', '09:00', '17:00', '60', 'Quidco BAU', None
+    )
+    day = naturalhr.datetime(2020, 1, 7)
+    week = naturalhr.datetime(2020, 1, 6)
+    naturalhr.store_timesheets(
+        None,
+        [
+            naturalhr.TimeSheetEntry(week, day, '0900', '1700', '60', 'BAU', ''),
+            naturalhr.TimeSheetEntry(week, day, '1700', '1800', '0', 'Off', ''),
+            naturalhr.TimeSheetEntry(week, day, '1730', '1830', '0', 'Off', ''),
+        ],
+        [existing],
+    )
+    assert [params['start'] for params in posted] == ['1700']
+
+
+def test_naturalhr_credentials_are_private(tmp_path, monkeypatch):
+    monkeypatch.setattr(naturalhr, 'CACHE_HOME', tmp_path)
+    credentials = tmp_path.joinpath(naturalhr.NATURAL_HR_CREDENTIALS)
+    credentials.touch(mode=0o644)
+    previous_umask = os.umask(0o022)
+    try:
+        cache = naturalhr.SessionManager().cache
+        cache.set('NaturalHRSession', naturalhr.NATURAL_HR_COOKIE, 'id', 60)
+    finally:
+        os.umask(previous_umask)
+    assert stat.S_IMODE(credentials.stat().st_mode) == 0o600
+    assert cache.get('NaturalHRSession', naturalhr.NATURAL_HR_COOKIE).value == 'id'
+
+
+def test_naturalhr_leave_calendar_merges_leave():
+    def time_off(leave_type, start, end):
+        return TimeOff(leave_type, start, end, '1', 'Approved', 'Taken')
+
+    calendar = LeaveCalendar(
+        [
+            time_off('Leave', datetime(2020, 1, 8), datetime(2020, 1, 9)),
+            time_off('WFH', datetime(2020, 1, 13), datetime(2020, 1, 13)),
+            time_off('Leave', datetime(2020, 1, 6), datetime(2020, 1, 7)),
+            time_off('Leave', datetime(2020, 1, 9), datetime(2020, 1, 14)),
+        ]
+    )
+    assert len(calendar) == 4
+    assert len(calendar.starts) == 1
+    assert datetime(2020, 1, 6) in calendar
+    assert datetime(2020, 1, 14).date() in calendar
+    # weekends and days after the last request
+    assert datetime(2020, 1, 11) not in calendar
+    assert datetime(2020, 1, 15) not in calendar
+    assert [
+        request.leave_type
+        for request in calendar.overlapping(
+            datetime(2020, 1, 13), datetime(2020, 1, 20)
+        )
+    ] == ['Leave', 'WFH']
+
+
+def test_toggl_writer_retries_rate_limited_posts():
+    class Toggl:
+        responses = [
+            fake_response(429, headers={'Retry-After': '0.01'}),
+            fake_response(200, dict(data=dict(id=1))),
+            fake_response(400),
+            requests.ConnectionError('connection reset'),
+            fake_response(200, dict(data=dict(id=2))),
+            fake_response(200),
+            fake_response(201, dict(errors=[])),
+        ]
+
+        def post(self, path, json):
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+    writer = TogglWriter(Toggl(), rate=1000)
+    for duration in (3600, 1800, 900, 600, 300, 60):
+        writer.queue(
+            CreateTimeEntry(
+                pid=1,
+                jira_ref='',
+                description='standup',
+                duration=duration,
+                start=datetime(2020, 3, 3, 10),
+            )
+        )
+    results = writer.flush()
+
+    assert [(result.status, result.id) for result in results] == [
+        (200, 1),
+        (400, None),
+        (None, None),
+        (200, 2),
+        (200, None),
+        (201, None),
+    ]
+    assert results[2].error == 'connection reset'
+    assert results[4].error.startswith('unexpected response: ')
+    assert results[5].error == "unexpected response: KeyError('data')"
+    assert not writer.queued
+
+
+def test_slack_user_id_by_email_scans_roster_once(tmp_path):
+    class Body:
+        def __init__(self, body):
+            self.body = body
+
+    class Users:
+        calls = []
+
+        def get(self, method, params):
+            self.calls.append((method, params.get('cursor')))
+            if method == 'users.lookupByEmail':
+                raise Error('missing_scope')
+            if not params.get('cursor'):
+                return Body(
+                    dict(
+                        members=[dict(id='U1', profile=dict(email='a@example.com'))],
+                        response_metadata=dict(next_cursor='page-2'),
+                    )
+                )
+            return Body(
+                dict(members=[dict(id='U2', profile=dict(email='b@example.com'))])
+            )
+
+    class Slack:
+        users = Users()
+
+    cache = LocalCache(tmp_path.joinpath('cache.sqlite'))
+    assert slack_user_id_by_email(Slack(), 'b@example.com', cache) == 'U2'
+    assert slack_user_id_by_email(Slack(), 'a@example.com', cache) == 'U1'
+    assert slack_user_id_by_email(Slack(), 'b@example.com', cache) == 'U2'
+    assert Users.calls == [
+        ('users.lookupByEmail', None),
+        ('users.list', None),
+        ('users.list', 'page-2'),
+    ]
+
+
+STANDUP = '''# 2020-03-03 [6]
+
+## Yesterday
+
+- QCO-1 rebuild event sourcing 5h
+- standup 1h
+
+## Today
+
+- QCO-2 review
+'''
+
+
+def test_standup_repository_parses_each_version_once(tmp_path, monkeypatch):
+    parsed = []
+    from_markdown = synthetic.Standup.from_markdown.__func__
+
+    def counting_from_markdown(cls, markdown):
+        parsed.append(markdown)
+        return from_markdown(cls, markdown)
+
+    monkeypatch.setattr(
+        synthetic.Standup, 'from_markdown', classmethod(counting_from_markdown)
+    )
+    tmp_path.joinpath('2020-03-03.md').write_text(STANDUP)
+    standups = StandupRepository(tmp_path, LocalCache(tmp_path.joinpath('c.sqlite')))
+
+    standup = standups.get(date(2020, 3, 3))
+    assert standup.yesterday == ['QCO-1 rebuild event sourcing 5h', 'standup 1h']
+    assert standup.hours == 6
+    assert standup.comments.startswith('\n## Yesterday')
+    assert standups.get(date(2020, 3, 3)) == standup
+    assert len(parsed) == 1
+
+    tmp_path.joinpath('2020-03-03.md').write_text(STANDUP.replace('[6]', '[8]'))
+    assert standups.get(date(2020, 3, 3)).hours == 8
+    assert len(parsed) == 2
+
+
+def test_standup_repository_date_index(tmp_path):
+    for day in ['2020-03-02', '2020-03-04', '2020-03-09']:
+        tmp_path.joinpath(f'{day}.md').write_text(STANDUP)
+    tmp_path.joinpath('synthetic.json').write_text('{}')
+    standups = StandupRepository(tmp_path)
+
+    assert standups.dates(date(2020, 3, 1), datetime(2020, 3, 6)) == [
+        date(2020, 3, 2),
+        date(2020, 3, 4),
+    ]
+    assert standups.missing(date(2020, 3, 2), date(2020, 3, 9)) == [
+        date(2020, 3, 3),
+        date(2020, 3, 5),
+        date(2020, 3, 6),
+    ]
+    assert standups.exists(datetime(2020, 3, 9))
+    assert not standups.exists(date(2020, 3, 3))
+
+    tmp_path.joinpath('2020-03-03.md').write_text(STANDUP)
+    tmp_path.joinpath('2020-03-09.md').unlink()
+    assert standups.index() == [date(2020, 3, 2), date(2020, 3, 3), date(2020, 3, 4)]
+    assert list(standups.standups(date(2020, 3, 3), date(2020, 3, 3))) == [
+        date(2020, 3, 3)
+    ]
+
+
+def test_note_from_text_tokenizes_refs_and_durations():
+    note = Note.from_text(
+        'TECH-548 TECH-562 🚀 merged kraken#9, kraken#11 and 2h-review 1h30m'
+    )
+    assert note.jira_refs == ['TECH-548', 'TECH-562']
+    assert note.pull_request_refs == [('kraken', 9), ('kraken', 11)]
+    assert note.duration == '1h30m'
+    assert note.ticket is None
+    assert note.description == (
+        'TECH-548 TECH-562 🚀 merged kraken#9, kraken#11 and 2h-review'
+    )
+    assert [token.kind for token in note.tokens] == [
+        'jira_ref',
+        'jira_ref',
+        'pull_request',
+        'pull_request',
+        'duration',
+    ]
+
+    notes = parse_notes(['QWA Release Manager 1h', '', 'QCO-1 QCO-1 rebuild 7h'])
+    assert [(note.description, note.duration) for note in notes] == [
+        ('QWA Release Manager', '1h'),
+        ('QCO-1 QCO-1 rebuild', '7h'),
+    ]
+    assert notes[1].resolve({'QCO-1': 'ticket'}).ticket == 'ticket'
+
+
+@pytest.mark.parametrize(
+    'line, description, duration',
+    [
+        ('QCO-1 fix 45min', 'QCO-1 fix', '45m'),
+        ('QCO-1 pairing 1h30', 'QCO-1 pairing', '1h30m'),
+        ('QCO-1 deploy 4hrs', 'QCO-1 deploy', '4h'),
+        ('QCO-1 fix 2h then 45min', 'QCO-1 fix 2h then', '45m'),
+        ('QCO-3 on-call 24h rota 2h', 'QCO-3 on-call 24h rota', '2h'),
+        ('QCO-1 migrate 5m rows 3h', 'QCO-1 migrate 5m rows', '3h'),
+        ('TECH-1 upgrade to 2h cadence 4h', 'TECH-1 upgrade to 2h cadence', '4h'),
+        ('QCO-1 review QCO-1 again 1h', 'QCO-1 review QCO-1 again', '1h'),
+        ('QCO-1 3monkeys', 'QCO-1 3monkeys', None),
+    ],
+)
+def test_note_from_text_durations(line, description, duration):
+    note = Note.from_text(line)
+    assert (note.description, note.duration) == (description, duration)
+
+
+def test_bitbucket_pull_requests_are_resolved_once_per_ref(monkeypatch):
+    standup = Standup(
+        date='2020-03-03',
+        yesterday=['merged kraken#9, kraken#11 2h', 'quidco-web-app#1 review'],
+        today=['kraken#9 follow up'],
+    )
+    refs = standup.pull_request_refs()
+    assert refs == [('kraken', 9), ('kraken', 11), ('quidco-web-app', 1)]
+
+    requested = []
+
+    def get(path, **kwargs):
+        requested.append(path)
+
+        return fake_response(
+            payload=dict(
+                links=dict(html=dict(href=path)),
+                title='title',
+                state='OPEN',
+                participants=[dict(approved=True), dict(approved=False)],
+                comment_count=3,
+            ),
+            headers={'ETag': '"v1"'},
+        )
+
+    bitbucket = BitbucketSession('user', 'token')
+    monkeypatch.setattr(bitbucket, 'get', get)
+    pull_requests = bitbucket.pull_requests_for(refs + refs)
+
+    assert sorted(requested) == [
+        'repositories/john_pervanas/quidco-web-app/pullrequests/1',
+        'repositories/maplesyrupgroup/kraken/pullrequests/11',
+        'repositories/maplesyrupgroup/kraken/pullrequests/9',
+    ]
+    assert pull_requests[('kraken', 9)] == PullRequest(
+        repo_name='kraken',
+        pr_id=9,
+        link='repositories/maplesyrupgroup/kraken/pullrequests/9',
+        title='title',
+        state='OPEN',
+        approvals=1,
+        comments=3,
+    )
+
+
+def test_bitbucket_repository_orgs_are_parsed_on_use():
+    bitbucket = BitbucketSession('user', 'token', repository_orgs='web=acme,,')
+    assert bitbucket.org_for('web') == 'acme'
+    assert bitbucket.org_for('kraken') == 'maplesyrupgroup'
+
+    with pytest.raises(click.UsageError, match="'api='"):
+        BitbucketSession('user', 'token', repository_orgs='web=acme,api=')
+
+
+def test_async_engine_bounds_each_host_and_cancels_on_interrupt():
+    lock, in_flight, peak, fetched = threading.Lock(), Counter(), Counter(), []
+
+    def fetch(key):
+        host = key[0]
+        with lock:
+            in_flight[host] += 1
+            peak[host] = max(peak[host], in_flight[host])
+        time.sleep(0.01)
+        with lock:
+            in_flight[host] -= 1
+        return key.upper()
+
+    engine = AsyncEngine(concurrency=2)
+
+    async def fetch_all():
+        return await asyncio.gather(
+            *(engine.call(key[0], fetch, key) for key in ['a1', 'a2', 'a3', 'a4', 'b1'])
+        )
+
+    assert engine.run(fetch_all()) == ['A1', 'A2', 'A3', 'A4', 'B1']
+    assert peak == dict(a=2, b=1)
+    assert engine.map('a', fetch, ['a1', 'a2']) == dict(a1='A1', a2='A2')
+
+    def interrupt(key):
+        if key == 0:
+            raise KeyboardInterrupt
+        time.sleep(0.01)
+        fetched.append(key)
+
+    engine.concurrency = 1
+    with pytest.raises(KeyboardInterrupt):
+        engine.map('host', interrupt, list(range(10)))
+    time.sleep(0.05)
+    assert fetched == []
+
+
+def test_async_engine_runs_are_independent(caplog):
+    engine = AsyncEngine(concurrency=2)
+    nested = engine.map(
+        'a',
+        lambda key: engine.map('b', str.upper, [f'{key}1', f'{key}2']),
+        ['x', 'y'],
+    )
+    assert nested == dict(x=dict(x1='X1', x2='X2'), y=dict(y1='Y1', y2='Y2'))
+    assert engine._runs == {}
+
+    def interrupt(key):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        engine.map('host', interrupt, [1, 2])
+    gc.collect()
+    assert 'never retrieved' not in caplog.text
+
+    engine.concurrency = 20
+    assert shared_transport()._pool_maxsize == 20
+
+
+def test_sessions_share_one_transport():
+    sessions = [
+        TogglSession('token'),
+        JiraSession('user', 'token'),
+        BitbucketSession('user', 'token'),
+        mount_transport(requests.Session()),
+    ]
+    assert {id(session.get_adapter('https://example.com')) for session in sessions} == {
+        id(shared_transport())
+    }
+    assert shared_transport().timeout == (3.05, 30)
+    assert shared_transport().max_retries.get_backoff_time() == 0
+
+
+def test_profiler_summary_and_trace():
+    profiler = Profiler()
+    with profiler.span('http', 'GET example.com') as details:
+        details['status'] = 200
+    assert profiler.spans == []
+
+    profiler.enabled = True
+    for status in (200, 304):
+        with profiler.span('http', 'GET example.com', path='/') as details:
+            details['status'] = status
+    with profiler.span('parse', 'standup markdown'):
+        pass
+
+    assert {(row[0], row[1], row[2]) for row in profiler.summary()} == {
+        ('http', 'GET example.com', 2),
+        ('parse', 'standup markdown', 1),
+    }
+    events = profiler.chrome_trace()['traceEvents']
+    assert [event['args'] for event in events] == [
+        dict(path='/', status=200),
+        dict(path='/', status=304),
+        {},
+    ]
+    assert {event['ph'] for event in events} == {'X'}